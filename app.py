@@ -5,24 +5,43 @@
 # ## Import
 
 # %%
-from docling.document_converter import DocumentConverter
-import tqdm as notebook_tqdm
-from pydantic import BaseModel, Field 
+# docling, docx and the provider SDKs are imported where they are used, so that only the required ones are loaded
+from pydantic import BaseModel, Field, ValidationError
 import os
-from typing import Optional, Any, Literal, Dict, List, Tuple
+from typing import Optional, Any, Literal, Dict, List, Tuple, Annotated, Generator, NamedTuple, Callable
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
 from langgraph.types import Command
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langgraph.checkpoint.sqlite import SqliteSaver
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda, RunnableConfig
+from langchain_core.messages import AIMessage
+from langchain_core.exceptions import OutputParserException
 # from langfuse.callback import CallbackHandler
 import gradio as gr
-import contextlib
+import contextvars
+import asyncio
+import sys
 from io import StringIO
-import docx
 from pathlib import Path
 import re
+import threading
+import hashlib
+import time
+import random
+import json
+import sqlite3
+import uuid
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import subprocess
+import atexit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+import numpy as np
 from typing import Union
 from dotenv import load_dotenv
 
@@ -38,15 +57,162 @@ langfuse_handler = None
 if langfuse_handler:
     TRACING = True
 
+# %% [markdown]
+# ### Metrics
+# - Counters and latency histograms per agent and provider, always enabled
+# - Exported in the Prometheus text format (`/metrics`) and as JSON summary (`/metrics.json`) by the metrics server
+
+# %%
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+class MetricsRegistry:
+    "Thread-safe counters, gauges and histograms with labels, exported in the Prometheus text format and as JSON summary"
+
+    def __init__(self, buckets : Tuple[float, ...] = LATENCY_BUCKETS, samples : int = 1000):
+        self.buckets = buckets
+        self.samples = samples
+        self._lock = threading.Lock()
+        self._help : Dict[str, str] = {}
+        self._counters : Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {}
+        self._gauges : Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {}
+        # histogram series: bucket counts, sum, count and the most recent samples for exact percentiles
+        self._histograms : Dict[str, Dict[Tuple[Tuple[str, str], ...], Dict[str, Any]]] = {}
+
+    def describe(self, name : str, help_text : str):
+        self._help[name] = help_text
+
+    def inc(self, name : str, value : float = 1.0, **labels):
+        "Increase a counter"
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set(self, name : str, value : float, **labels):
+        "Set a gauge"
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def observe(self, name : str, value : float, **labels):
+        "Add an observation to a histogram"
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {}).get(key)
+            if series is None:
+                series = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0, "samples": deque(maxlen=self.samples)}
+                self._histograms[name][key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+            series["samples"].append(value)
+
+    @staticmethod
+    def _labels(key : Tuple[Tuple[str, str], ...], extra : str = "") -> str:
+        labels = [f'{name}="{value}"' for name, value in key]
+        if extra:
+            labels.append(extra)
+        return "{" + ",".join(labels) + "}" if labels else ""
+
+    def prometheus(self) -> str:
+        "Return all metrics in the Prometheus text exposition format"
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{self._labels(key)} {value}")
+            for name, series in sorted(self._gauges.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} gauge")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{self._labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, count in zip(self.buckets, histogram["buckets"]):
+                        bucket_labels = self._labels(key, f'le="{bound}"')
+                        lines.append(f"{name}_bucket{bucket_labels} {count}")
+                    bucket_labels = self._labels(key, 'le="+Inf"')
+                    lines.append(f"{name}_bucket{bucket_labels} {histogram['count']}")
+                    lines.append(f"{name}_sum{self._labels(key)} {histogram['sum']}")
+                    lines.append(f"{name}_count{self._labels(key)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Any]:
+        "Return counters and histogram percentiles (over the most recent samples) as JSON-compatible dictionary"
+        summary = {"counters": {}, "gauges": {}, "histograms": {}}
+        with self._lock:
+            for name, series in self._counters.items():
+                summary["counters"][name] = [{"labels": dict(key), "value": value} for key, value in series.items()]
+            for name, series in self._gauges.items():
+                summary["gauges"][name] = [{"labels": dict(key), "value": value} for key, value in series.items()]
+            for name, series in self._histograms.items():
+                summary["histograms"][name] = []
+                for key, histogram in series.items():
+                    samples = sorted(histogram["samples"])
+                    percentile = lambda p: samples[min(int(p * len(samples)), len(samples) - 1)]
+                    summary["histograms"][name].append({
+                        "labels": dict(key),
+                        "count": histogram["count"],
+                        "mean": histogram["sum"] / histogram["count"],
+                        "p50": percentile(0.5),
+                        "p95": percentile(0.95),
+                        "p99": percentile(0.99)
+                    })
+        return summary
+
+metrics = MetricsRegistry()
+metrics.describe("llm_calls_total", "LLM calls by agent, model tier, provider, model and status (ok, error, parse_error, cached).")
+metrics.describe("llm_call_duration_seconds", "Wall-clock latency of LLM calls including retries.")
+metrics.describe("llm_retries_total", "Retries of failed LLM calls.")
+metrics.describe("llm_input_tokens_total", "Input tokens reported by the provider.")
+metrics.describe("llm_cached_input_tokens_total", "Input tokens served from the provider-side prompt cache.")
+metrics.describe("llm_output_tokens_total", "Output tokens reported by the provider.")
+metrics.describe("llm_cost_usd_total", "Estimated cost of the LLM calls in USD.")
+metrics.describe("agent_node_duration_seconds", "Wall-clock latency of a graph node.")
+metrics.describe("agent_node_runs_total", "Executions of graph nodes by status.")
+metrics.describe("llm_queue_delay_seconds", "Time LLM calls waited for the client-side rate limiter.")
+metrics.describe("llm_rate_limited_total", "LLM calls rejected by the provider with a rate limit error.")
+metrics.describe("llm_concurrency_limit", "Current adaptive limit of concurrent LLM calls per provider.")
+metrics.describe("planner_requests_total", "Plans by source: keyword rules, plan table or LLM planner.")
+metrics.describe("critic_lint_total", "Cover letter drafts checked locally before the LLM critic, failed drafts skip the LLM call.")
+metrics.describe("writer_draft_seconds", "Latency of the writer drafts by mode (rewrite, edits).")
+metrics.describe("writer_draft_output_tokens_total", "Output tokens of the writer drafts by mode (rewrite, edits) as reported by the provider, estimated for cached responses.")
+metrics.describe("docling_conversions_total", "Document conversions by status (ok, rejected, timeout, error).")
+metrics.describe("docling_queue_wait_seconds", "Time documents waited for a free extraction worker.")
+metrics.describe("docling_conversion_seconds", "Conversion time of documents in the extraction workers.")
+metrics.describe("writer_edit_fallbacks_total", "Edit-based revisions that couldn't be applied and fell back to a full rewrite.")
+
+# USD per million tokens (input, cached input, output), can be overridden with LLM_PRICES as JSON
+LLM_PRICES : Dict[str, Tuple[float, float, float]] = {
+    "Qwen/Qwen3-30B-A3B-fast": (0.30, 0.30, 0.90),
+    "gemini-2.0-flash": (0.10, 0.025, 0.40),
+    "gemini-2.5-flash": (0.30, 0.075, 2.50),
+    "gemini-2.5-pro": (1.25, 0.31, 10.00),
+    **{model: tuple(prices) for model, prices in json.loads(os.environ.get("LLM_PRICES", "{}")).items()}
+}
+
+def estimate_cost(model_name : str, input_tokens : int, cached_tokens : int, output_tokens : int) -> float:
+    "Estimate the cost of a call in USD, unknown models are counted as free"
+    input_price, cached_price, output_price = LLM_PRICES.get(model_name, (0.0, 0.0, 0.0))
+    return ((input_tokens - cached_tokens) * input_price + cached_tokens * cached_price + output_tokens * output_price) / 1_000_000
+
 # %% [markdown]
 # ## API Key
 
 # %%
 USE_GOOGLE = False
+ENDPOINT_URL = "https://api.studio.nebius.com/v1/"
+# live: call the provider, record: call the provider and write a cassette, replay: serve the cassette without network access
+LLM_MODE = os.environ.get("LLM_MODE", "live").lower()
 try: 
     API_KEY = os.environ["NEBIUS_KEY"]
     MODEL_NAME = "Qwen/Qwen3-30B-A3B-fast"
-    ENDPOINT_URL = "https://api.studio.nebius.com/v1/"
     print("Using Nebius API")
 except:
     try:
@@ -55,7 +221,11 @@ except:
         USE_GOOGLE = True
         print("Using Google API")
     except:
-        raise ValueError("No NEBIUS API Key was found")
+        if LLM_MODE != "replay":
+            raise ValueError("No NEBIUS API Key was found")
+        API_KEY = None
+        MODEL_NAME = os.environ.get("REPLAY_MODEL_NAME", "replay")
+        print("Replaying recorded LLM responses without an API key")
 
 # %% [markdown]
 # ## Structured outputs
@@ -65,6 +235,18 @@ class Feedback(BaseModel):
     feedback : str = Field("", description="Constructive feedback, stating the points that can be improved.") 
     quality_flag : Literal["PERFECT", "NEEDS IMPROVEMENT"] = Field("NEEDS IMPROVEMENT", description="Tells whether the cover letter needs to be reworked.")
 
+class DraftRanking(BaseModel):
+    reasoning : str = Field("", description="Short comparison of the cover letter drafts.")
+    best_draft : int = Field(1, description="Number of the best cover letter draft, starting at 1.")
+    feedback : str = Field("", description="Constructive feedback for the best draft, stating the points that can be improved.")
+
+class ParagraphEdit(BaseModel):
+    paragraph : int = Field(1, description="Number of the paragraph of the previous draft to replace, starting at 1.")
+    text : str = Field("", description="New text of the paragraph, empty to remove the paragraph.")
+
+class DraftEdits(BaseModel):
+    edits : List[ParagraphEdit] = Field([], description="Paragraph replacements applied to the previous draft, unchanged paragraphs are omitted.")
+
 class MultiStepPlan(BaseModel):
     reasoning : str = Field("", description="The multi-step reasoning required to break down the user query in a plan.")
     plan : List[Literal["critic_agent", "writer_agent", "recruiter_agent", "team_lead_agent","interview_agent"]] = Field("END", description="The list of agents required to fulfill the user request determined by the Orchestrator.")
@@ -74,26 +256,52 @@ class MultiStepPlan(BaseModel):
 
 # %%
 class AgentDescription(TypedDict):
-    "Agent description containing the title, system prompt and description."
+    "Agent description containing the title, description and the role-specific instructions."
     title : str 
     description : str 
-    system_prompt : str
+    instructions : str
+
+# Marker to replace the message history instead of appending to it, e. g. when the orchestrator restarts the conversation
+RESET_MESSAGES = ("__reset__", "")
+
+def merge_messages(left : List[Tuple[str,str]], right : List[Tuple[str,str]]) -> List[Tuple[str,str]]:
+    "Reducer for the agent messages, so that agents running in parallel can all contribute to the history"
+    right = [tuple(message) for message in right]
+    if right and right[0] == RESET_MESSAGES:
+        return right[1:]
+    return [tuple(message) for message in left] + right
+
+def merge_artifacts(left : Dict[str, str], right : Dict[str, str]) -> Dict[str, str]:
+    "Reducer for the agent artifacts, a new artifact replaces the previous one of the same agent"
+    agents = {key.split(":")[0] for key in right}
+    return {**{key: value for key, value in left.items() if key.split(":")[0] not in agents}, **right}
 
 class ApplicationAgentState(BaseModel):
     """State of the cover letter writer agent."""
+    session_id : str = Field("", description="Id of the user session, graph runs are checkpointed per session and query.")
     user_query : Optional[str] = Field("", description="User task for the agents to fulfill.")
     iterations : Optional[int] = Field(0, description="Counter for the evaluation-optimization loop of the cover letter.")
     max_iterations : Optional[int] = Field(3, description="Maximum number of iterations for the evaluation-optimization loop of the cover letter.")
-    available_agents : Dict[str, AgentDescription] = Field(description="A dictionary of the available agents.")
     cv: Optional[str] = Field("",description="CV content parsed as a Markdown format from the document.")
     job_description : Optional[str] = Field("", description="Job description.")
     skills : Optional[str] = Field("", description="Required skills extracted from the job description")
     motivation : Optional[str] = Field("", description="You're desired job profiles and general motivation.")
     examples : Optional[str] = Field("", description="Examples of previous cover letters.")
     phase : Literal["PLAN", "EXECUTE", "ANSWER"] = Field("PLAN", description="Current phase of the agent")
-    messages : List[Tuple[str,str]] = Field([], description="List of agent thoughts (agent, agent response).") 
+    messages : Annotated[List[Tuple[str,str]], merge_messages] = Field([], description="List of agent thoughts (agent, agent response).") 
     final_answer : str = Field("", description="Final answer generated after task execution.")
     plan : List[Literal["critic_agent", "writer_agent", "recruiter_agent", "team_lead_agent","interview_agent"]] = Field([],description="The current list of tasks to execute")
+    executing : List[str] = Field([], description="Agents of the plan that are currently executed in parallel.")
+    history_mode : Literal["full", "compact"] = Field("compact", description="Whether agents receive the full message history or only the latest draft, feedback and agent contributions.")
+    drafting_mode : Literal["iterative", "best_of_n"] = Field("iterative", description="Whether the writer revises one draft with the critic or writes several drafts in parallel that the critic ranks.")
+    num_drafts : int = Field(3, description="Number of drafts written in parallel in the best-of-n drafting mode.")
+    drafts : List[str] = Field([], description="Drafts of the writer waiting to be ranked by the critic.")
+    revision_mode : Literal["edits", "rewrite"] = Field("edits", description="Whether the writer revises a draft with paragraph edits or rewrites the whole cover letter.")
+    context_mode : Literal["retrieval", "full"] = Field("retrieval", description="Whether agents receive the sections of the CV and examples most relevant to the job description or the complete documents.")
+    cv_context : str = Field("", description="Sections of the CV most relevant to the job description, selected at extraction time.")
+    examples_context : str = Field("", description="Sections of the previous cover letters most relevant to the job description, selected at extraction time.")
+    model_tiers : Literal["tiered", "strong", "fast"] = Field("tiered", description="Whether every agent uses the model of its tier or all agents use the strong or the fast model.")
+    artifacts : Annotated[Dict[str, str], merge_artifacts] = Field({}, description="Latest output of the reusable agents keyed by agent and hash of the session inputs.")
     cover_letter: Optional[str] = Field("", description="The cover letter for the specified job.")
     connected_skills : Optional[str] = Field("", description="Skills from the job description connected to previous working experience from the CV.")
     feedback : str = Field("", description="Written feedback from the critic agent regarding the cover letter.")
@@ -403,29 +611,30 @@ Your output should enable the hiring team to conduct a thorough, fair, and insig
 recruiter_agent_description = AgentDescription(
     title="recruiter_agent",
     description="The recruiter agent provides general feedback about the applicant.",
-    system_prompt=general_prefix+recruiter_prompt
+    instructions=recruiter_prompt
 )
 writer_agent_description = AgentDescription(
     title="writer_agent",
     description="The writer agent can write a cover letter for the applicant.",
-    system_prompt=general_prefix+writer_prompt
+    instructions=writer_prompt
 )
 critic_agent_description = AgentDescription(
     title="critic_agent",
     description="The critic agent provides feedback for a written cover letter.",
-    system_prompt=general_prefix+critic_prompt
+    instructions=critic_prompt
 )
 interview_agent_description = AgentDescription(
     title="interview_agent",
     description="The interview question agent can generate interview questions for the candidate based on specialized feedback. It only makes sense to call the interview agent after feedback was provided to improve the results.",
-    system_prompt=general_prefix+interview_prompt
+    instructions=interview_prompt
 )
 team_lead_agent_description = AgentDescription(
     title="team_lead_agent",
     description="The team lead agent provides feedback about the applicant from the perspective of the team lead of the team of the open position.",
-    system_prompt=general_prefix+team_lead_prompt
+    instructions=team_lead_prompt
 )
-available_agents = {
+# Registry of the agents, held once per process instead of in every session state
+AGENT_REGISTRY : Dict[str, AgentDescription] = {
     "recruiter_agent" : recruiter_agent_description,
     "writer_agent" : writer_agent_description,
     "critic_agent" : critic_agent_description,
@@ -433,6 +642,157 @@ available_agents = {
     "team_lead_agent": team_lead_agent_description
 }
 
+# %% [markdown]
+# ### Plan dependencies
+# - Steps of a plan only wait for the earlier steps they depend on, independent steps are executed in parallel
+# - The writer and critic agent route between each other and are therefore always executed on their own
+
+# %%
+AGENT_DEPENDENCIES : Dict[str, List[str]] = {
+    "recruiter_agent" : [],
+    "team_lead_agent" : [],
+    "writer_agent" : ["recruiter_agent", "team_lead_agent"],
+    "critic_agent" : ["writer_agent"],
+    "interview_agent" : ["recruiter_agent", "team_lead_agent", "writer_agent"]
+}
+EXCLUSIVE_AGENTS = ["writer_agent", "critic_agent"]
+
+def schedule_next_steps(plan : List[str]) -> Tuple[List[str], List[str]]:
+    "Split the plan into the next group of steps that can run in parallel and the remaining steps"
+    steps = []
+    for i, agent in enumerate(plan):
+        if agent in EXCLUSIVE_AGENTS:
+            if not steps:
+                steps.append(agent)
+            break
+        # an agent has to wait if one of its dependencies (or another run of itself) comes earlier in the plan
+        if agent in steps or any(dependency in plan[:i] for dependency in AGENT_DEPENDENCIES.get(agent, [])):
+            break
+        steps.append(agent)
+    return steps, plan[len(steps):]
+
+# %% [markdown]
+# ### Fast-path planner
+# - Common queries are routed by keyword rules without the orchestrator LLM call, e. g. "Generate a cover letter" or requests for interview questions
+# - Plans of the LLM planner are kept in a small table keyed on the normalised query, so repeated queries skip the call as well
+# - Queries with negations, long queries or queries no rule matches fall back to the LLM planner
+
+# %%
+FAST_PLANNER = os.environ.get("FAST_PLANNER", "on").lower() != "off"
+FAST_PLAN_MAX_WORDS = int(os.environ.get("FAST_PLAN_MAX_WORDS", 30))
+FAST_PLAN_TABLE_SIZE = int(os.environ.get("FAST_PLAN_TABLE_SIZE", 256))
+
+# intent rules, the plan of a query is the union of the agents of all matching rules in the order of PLAN_AGENT_ORDER
+PLAN_RULES : List[Tuple[str, re.Pattern, List[str]]] = [
+    ("cover_letter", re.compile(r"^(a |the )?(cover|motivation(al)?) letter$|\b(write|generate|create|draft|craft|compose|prepare)\b.*\b(cover|motivation(al)?) letter\b"), ["writer_agent"]),
+    ("interview_questions", re.compile(r"\binterview\b.*\bquestions?\b|\bquestions?\b.*\binterview\b"), ["recruiter_agent", "team_lead_agent", "interview_agent"]),
+    ("recruiter_feedback", re.compile(r"\b(recruiter|hr)\b.*\b(feedback|assessment|evaluat\w*|review|perspective)\b|\b(feedback|assessment|evaluat\w*|review|perspective)\b.*\b(recruiter|hr)\b"), ["recruiter_agent"]),
+    ("team_lead_feedback", re.compile(r"\b(team lead|hiring manager)\b.*\b(feedback|assessment|evaluat\w*|review|perspective)\b|\b(feedback|assessment|evaluat\w*|review|perspective)\b.*\b(team lead|hiring manager)\b"), ["team_lead_agent"]),
+]
+PLAN_AGENT_ORDER = ["recruiter_agent", "team_lead_agent", "writer_agent", "interview_agent"]
+# the rules can't tell what the user does not want
+NEGATION_PATTERN = re.compile(r"\b(not|no|don't|dont|do not|without|instead|except|skip)\b")
+
+_plan_table : OrderedDict = OrderedDict()
+_plan_table_lock = threading.Lock()
+_planner_stats = {"rule": 0, "table": 0, "llm": 0}
+_planner_stats_lock = threading.Lock()
+
+def count_plan(source : str):
+    "Count a plan by its source in the metrics and the log statistics"
+    with _planner_stats_lock:
+        _planner_stats[source] += 1
+    metrics.inc("planner_requests_total", source=source)
+
+def normalize_query(query : str) -> str:
+    "Lowercase the query and remove punctuation and repeated whitespace"
+    return " ".join(re.sub(r"[^\w\s']", " ", query.lower()).split())
+
+def fast_path_plan(query : str) -> Optional[MultiStepPlan]:
+    "Return a plan for the query without the LLM if a rule or the plan table is confident, otherwise None"
+    normalized = normalize_query(query)
+    with _plan_table_lock:
+        plan = _plan_table.get(normalized)
+        if plan is not None:
+            _plan_table.move_to_end(normalized)
+    if plan is not None:
+        count_plan("table")
+        return plan.model_copy(deep=True)
+
+    if normalized and len(normalized.split()) <= FAST_PLAN_MAX_WORDS and not NEGATION_PATTERN.search(normalized):
+        matched = [(name, agents) for name, pattern, agents in PLAN_RULES if pattern.search(normalized)]
+        if matched:
+            agents = {agent for _, rule_agents in matched for agent in rule_agents}
+            count_plan("rule")
+            return MultiStepPlan(
+                reasoning=f"Fast-path plan, the query matches the rules: {', '.join(name for name, _ in matched)}.",
+                plan=[agent for agent in PLAN_AGENT_ORDER if agent in agents]
+            )
+
+    count_plan("llm")
+    return None
+
+def remember_plan(query : str, plan : MultiStepPlan):
+    "Store a plan of the LLM planner in the plan table"
+    with _plan_table_lock:
+        _plan_table[normalize_query(query)] = plan.model_copy(deep=True)
+        _plan_table.move_to_end(normalize_query(query))
+        while len(_plan_table) > FAST_PLAN_TABLE_SIZE:
+            _plan_table.popitem(last=False)
+
+def planner_stats() -> Dict[str, int]:
+    "Number of plans by source: keyword rules, plan table and LLM planner"
+    with _planner_stats_lock:
+        return dict(_planner_stats)
+
+# %% [markdown]
+# ### Agent artifacts
+# - The assessments of the recruiter and the team lead agent only depend on the session inputs (CV, job description, motivation, examples)
+# - Their latest output is kept in the session state, keyed by the agent and a hash of the inputs, and survives the reset of the messages after a final answer
+# - The planner removes steps that are already satisfied from the plan and passes the stored assessment to the other agents, until the inputs change
+# - Set `ARTIFACT_REUSE=off` to always call the agents
+
+# %%
+ARTIFACT_REUSE = os.environ.get("ARTIFACT_REUSE", "on").lower() != "off"
+REUSABLE_AGENTS = ["recruiter_agent", "team_lead_agent"]
+
+_artifact_stats = {"reused": 0, "stored": 0}
+_artifact_stats_lock = threading.Lock()
+
+def artifact_key(agent : str, state : ApplicationAgentState) -> str:
+    "Key of an agent artifact: the agent and a hash of the inputs its output depends on"
+    inputs = json.dumps([state.cv, state.job_description, state.motivation, state.examples])
+    return f"{agent}:{hashlib.sha256(inputs.encode('utf-8')).hexdigest()[:16]}"
+
+def store_artifact(agent : str, state : ApplicationAgentState, output : str) -> Dict[str, str]:
+    "State update storing the output of a reusable agent"
+    if not ARTIFACT_REUSE or agent not in REUSABLE_AGENTS:
+        return {}
+    with _artifact_stats_lock:
+        _artifact_stats["stored"] += 1
+    return {artifact_key(agent, state): output}
+
+def current_artifacts(state : ApplicationAgentState) -> Dict[str, str]:
+    "Artifacts that are still valid for the current inputs"
+    valid = {artifact_key(agent, state) for agent in REUSABLE_AGENTS}
+    return {key: output for key, output in state.artifacts.items() if key in valid}
+
+def reuse_artifacts(plan : List[str], state : ApplicationAgentState) -> Tuple[List[str], List[Tuple[str, str]]]:
+    "Remove the steps satisfied by stored artifacts from the plan, returns the remaining plan and the reused contributions"
+    if not ARTIFACT_REUSE:
+        return plan, []
+    artifacts = current_artifacts(state)
+    reused = [agent for agent in dict.fromkeys(plan) if artifact_key(agent, state) in artifacts]
+    for agent in reused:
+        metrics.inc("artifact_reuse_total", agent=agent)
+    with _artifact_stats_lock:
+        _artifact_stats["reused"] += len(reused)
+    return [agent for agent in plan if agent not in reused], [(agent, artifacts[artifact_key(agent, state)]) for agent in reused]
+
+def artifact_stats() -> Dict[str, int]:
+    with _artifact_stats_lock:
+        return dict(_artifact_stats)
+
 # %% [markdown]
 # ## Utilities
 
@@ -440,11 +800,63 @@ available_agents = {
 # ### General utilities
 
 # %%
-def docling_extraction(source : str = "CV.pdf") -> str:
-    "Extract CV and convert it to Markdown using docling"
-    converter = DocumentConverter()
-    result = converter.convert(source)
-    return result.document.export_to_markdown()
+DOCLING_CACHE_DIR = Path(os.environ.get("DOCLING_CACHE_DIR", ".cache/docling"))
+DOCLING_CACHE_MAX_BYTES = int(os.environ.get("DOCLING_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+_document_converter = None
+_document_converter_lock = threading.Lock()
+_docling_cache_lock = threading.Lock()
+_docling_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def get_document_converter() -> Any:
+    "Return the shared docling converter, the layout and table models are only loaded once"
+    global _document_converter
+    if _document_converter is None:
+        with _document_converter_lock:
+            if _document_converter is None:
+                from docling.document_converter import DocumentConverter
+                _document_converter = DocumentConverter()
+    return _document_converter
+
+def _evict_docling_cache():
+    "Remove the least recently used cache entries until the cache fits into DOCLING_CACHE_MAX_BYTES"
+    entries = sorted(DOCLING_CACHE_DIR.glob("*.md"), key=lambda p: p.stat().st_mtime)
+    total_size = sum(p.stat().st_size for p in entries)
+    for entry in entries:
+        if total_size <= DOCLING_CACHE_MAX_BYTES:
+            break
+        total_size -= entry.stat().st_size
+        entry.unlink(missing_ok=True)
+        _docling_cache_stats["evictions"] += 1
+
+def docling_extraction(source : Union[str, Path] = "CV.pdf") -> str:
+    "Extract CV and convert it to Markdown using docling, results are cached by the SHA-256 of the file content"
+    digest = hashlib.sha256(Path(source).read_bytes()).hexdigest()
+    cache_file = DOCLING_CACHE_DIR / f"{digest}.md"
+
+    with _docling_cache_lock:
+        if cache_file.exists():
+            _docling_cache_stats["hits"] += 1
+            # refresh the access time for the LRU eviction
+            os.utime(cache_file)
+            return cache_file.read_text(encoding="utf-8")
+        _docling_cache_stats["misses"] += 1
+
+    markdown = convert_document(source)
+
+    with _docling_cache_lock:
+        DOCLING_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_file.write_text(markdown, encoding="utf-8")
+        tmp_file.replace(cache_file)
+        _evict_docling_cache()
+
+    return markdown
+
+def docling_cache_stats() -> Dict[str, int]:
+    "Return the hit/miss/eviction counts of the docling extraction cache"
+    with _docling_cache_lock:
+        return dict(_docling_cache_stats)
 
 def read_file_content(file: Union[str, Path]) -> str:
     file_path = Path(file)
@@ -455,80 +867,1345 @@ def read_file_content(file: Union[str, Path]) -> str:
     
     elif suffix == ".pdf":
         # Extract CV and convert it to Markdown using docling
-        converter = DocumentConverter()
-        result = converter.convert(file_path)
-        return result.document.export_to_markdown()
+        return docling_extraction(file_path)
 
     elif suffix == ".docx":
+        import docx
         return "\n".join(p.text for p in docx.Document(file_path).paragraphs)
 
     else:
         return ""
 
-def call_llm(system_prompt, user_prompt, response_format : Any = None) -> Any:
+class PendingLLMCall:
+    "Steps of an LLM call shared by call_llm and acall_llm: response cache, rate limiter slots, retries, recording"
+
+    def __init__(self, system_prompt : str, user_prompt : str, response_format : Any = None, use_cache : bool = True):
+        self.system_prompt = system_prompt
+        self.user_prompt = user_prompt
+        self.response_format = response_format
+        self.cache_key = llm_cache_key(system_prompt, user_prompt, response_format) if use_cache and LLM_CACHE_ENABLED else None
+        self.provider = llm_target()[0]
+        self.reserved_tokens = estimate_tokens(system_prompt + user_prompt) + LLM_EXPECTED_OUTPUT_TOKENS
+        self.max_retries = LLM_MAX_RETRIES.get(self.provider, 0)
+        self.start = time.perf_counter()
+        self.queued = 0.0
+
+    def cached_response(self) -> Any:
+        "Return the response of the response cache or None"
+        if self.cache_key is None:
+            return None
+        response = llm_response_cache.get(self.cache_key, self.response_format)
+        if response is not None:
+            record_cached_llm_call()
+            if LLM_MODE == "record":
+                llm_cassette.record(self.system_prompt, self.user_prompt, self.response_format, response)
+        return response
+
+    def uses_gemini_context_cache(self) -> bool:
+        return GEMINI_CONTEXT_CACHE and self.provider == "google"
+
+    def attempts(self) -> range:
+        "Start the timer and return the attempt numbers"
+        self.start = time.perf_counter()
+        return range(self.max_retries + 1)
+
+    def slot_acquired(self, delay : float):
+        "Add the wait for the rate limiter, it is reported separately from the latency of the call"
+        self.queued += delay
+
+    def failed(self, attempt : int, error : Exception) -> float:
+        "Release the slot of a failed attempt and re-raise the error if it isn't retried, returns the delay before the next attempt"
+        release_llm_slot(self.provider, self.reserved_tokens, error=error)
+        if attempt == self.max_retries or not is_retryable_error(error):
+            record_failed_llm_call(time.perf_counter() - self.start - self.queued, attempt)
+            raise error
+        print(f"LLM call failed ({error.__class__.__name__}), retrying ({attempt + 1}/{self.max_retries})")
+        return retry_delay(attempt, error)
+
+    def succeeded(self, raw_response : Any, attempt : int) -> Any:
+        "Release the slot, record the metrics and store the response in the cassette and the response cache"
+        release_llm_slot(self.provider, self.reserved_tokens, raw_response)
+        duration = time.perf_counter() - self.start - self.queued
+        response = finish_llm_call(raw_response, self.response_format, duration, attempt)
+
+        if LLM_MODE == "record":
+            usage = token_usage(raw_response["raw"] if self.response_format is not None else raw_response)
+            llm_cassette.record(self.system_prompt, self.user_prompt, self.response_format, response, usage, duration)
+
+        if self.cache_key is not None:
+            llm_response_cache.put(self.cache_key, response)
+
+        return response
+
+def call_llm(system_prompt, user_prompt, response_format : Any = None, use_cache : bool = True) -> Any:
     """
     Call LLM with provided system prompt and user prompt and the response format that should be enforced
     """
+    if LLM_MODE == "replay":
+        raw_response, duration = llm_cassette.replay(system_prompt, user_prompt, response_format)
+        time.sleep(duration)
+        return finish_llm_call(raw_response, response_format, duration)
+
+    call = PendingLLMCall(system_prompt, user_prompt, response_format, use_cache)
+    cached_response = call.cached_response()
+    if cached_response is not None:
+        return cached_response
+
+    cached_content = gemini_cached_content(system_prompt) if call.uses_gemini_context_cache() else None
+    chain, inputs = prepare_llm_call(system_prompt, user_prompt, response_format, cached_content)
+
+    for attempt in call.attempts():
+        call.slot_acquired(acquire_llm_slot(call.provider, call.reserved_tokens))
+        try:
+            raw_response = chain.invoke(inputs)
+        except Exception as e:
+            time.sleep(call.failed(attempt, e))
+        else:
+            return call.succeeded(raw_response, attempt)
+
+async def acall_llm(system_prompt, user_prompt, response_format : Any = None, use_cache : bool = True) -> Any:
+    """
+    Async variant of call_llm, the event loop stays responsive while waiting for the provider
+    """
+    if LLM_MODE == "replay":
+        raw_response, duration = llm_cassette.replay(system_prompt, user_prompt, response_format)
+        await asyncio.sleep(duration)
+        return finish_llm_call(raw_response, response_format, duration)
+
+    call = PendingLLMCall(system_prompt, user_prompt, response_format, use_cache)
+    cached_response = call.cached_response()
+    if cached_response is not None:
+        return cached_response
+
+    cached_content = await asyncio.to_thread(gemini_cached_content, system_prompt) if call.uses_gemini_context_cache() else None
+    chain, inputs = prepare_llm_call(system_prompt, user_prompt, response_format, cached_content)
+
+    for attempt in call.attempts():
+        call.slot_acquired(await aacquire_llm_slot(call.provider, call.reserved_tokens))
+        try:
+            raw_response = await chain.ainvoke(inputs)
+        except Exception as e:
+            await asyncio.sleep(call.failed(attempt, e))
+        else:
+            return call.succeeded(raw_response, attempt)
+
+def prepare_llm_call(system_prompt : str, user_prompt : str, response_format : Any = None, cached_content : Optional[str] = None) -> Tuple[Any, Dict[str, str]]:
+    "Return the chain and its inputs, the system prompt is omitted if it is served from a Gemini context cache"
+    if cached_content is not None:
+        return get_cached_content_chain(cached_content, response_format), {"user_prompt": user_prompt}
+    return get_llm_chain(response_format), {"system_prompt": system_prompt, "user_prompt": user_prompt}
+
+def finish_llm_call(response : Any, response_format : Any = None, duration : float = 0.0, retries : int = 0) -> Any:
+    "Record the metrics and report the token usage of the call, structured outputs are unwrapped and raise if they failed to parse"
+    message = response["raw"] if response_format is not None else response
+    usage = token_usage(message)
+    labels = llm_labels()
+    cost = estimate_cost(labels["model"], usage["input"], usage["cached"], usage["output"])
+    # with include_raw=True a structured output that failed to parse is returned as None instead of raising
+    parse_failed = response_format is not None and response.get("parsed") is None
+
+    metrics.inc("llm_calls_total", status="parse_error" if parse_failed else "ok", **labels)
+    metrics.observe("llm_call_duration_seconds", duration, **labels)
+    metrics.inc("llm_input_tokens_total", usage["input"], **labels)
+    metrics.inc("llm_cached_input_tokens_total", usage["cached"], **labels)
+    metrics.inc("llm_output_tokens_total", usage["output"], **labels)
+    metrics.inc("llm_cost_usd_total", cost, **labels)
+    if retries:
+        metrics.inc("llm_retries_total", retries, **labels)
+
+    record_tier_call(labels["tier"], duration, usage, cost)
+    add_node_usage(usage)
+    if usage["input"]:
+        print(f"📊 {current_agent.get()} ({labels['tier']} tier): {usage['input']} input tokens ({usage['cached']} cached, {usage['input'] - usage['cached']} uncached), {usage['output']} output tokens, {duration:.2f}s")
+    if parse_failed:
+        # raised before the response is recorded or cached
+        raise response.get("parsing_error") or OutputParserException(f"The response of {current_agent.get()} didn't match {response_format.__name__}.")
+    return response["parsed"] if response_format is not None else response
+
+def record_cached_llm_call():
+    "Count a call answered by the response cache"
+    metrics.inc("llm_calls_total", status="cached", **llm_labels())
+
+def record_failed_llm_call(duration : float, retries : int):
+    "Record the metrics of a call that failed after all retries"
+    labels = llm_labels()
+    metrics.inc("llm_calls_total", status="error", **labels)
+    metrics.observe("llm_call_duration_seconds", duration, **labels)
+    if retries:
+        metrics.inc("llm_retries_total", retries, **labels)
+
+def token_usage(message : Any) -> Dict[str, int]:
+    "Extract input, cached input and output tokens from the usage metadata of a LangChain message"
+    usage = getattr(message, "usage_metadata", None) or {}
+    input_details = usage.get("input_token_details") or {}
+    return {
+        "input": usage.get("input_tokens", 0) or 0,
+        "cached": input_details.get("cache_read", 0) or 0,
+        "output": usage.get("output_tokens", 0) or 0
+    }
+
+def serialize_messages(messages : List[Tuple[str,str]]) -> str:
+    "Returns a formatted message history of previous messages"
+    return "\n" +"\n".join(f"{role}:\n{content}" for role, content in messages)
+
+def strip_think_blocks(text: str) -> str:
+    return re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+
+def hide_think_blocks(text: str) -> str:
+    "Strip think blocks from a partially streamed text, including a block that is not closed yet"
+    return re.sub(r"<think>.*?(</think>|$)", "", text, flags=re.DOTALL)
+
+# %% [markdown]
+# ### Document extraction pool
+# - PDFs are converted in a pool of worker processes with the docling models loaded once per worker, so conversions don't block the request threads of other sessions
+# - Starting a worker takes a few seconds (it imports the app module), the pool is therefore started by the warm-up after launch
+# - Documents are only handed to the pool when a worker is free, so the timeout starts with the conversion and not in the queue; a hanging conversion terminates the pool, which is restarted on the next document
+# - Only `DOCLING_WORKERS + DOCLING_QUEUE_SIZE` documents are accepted at the same time, further uploads wait up to `DOCLING_QUEUE_TIMEOUT` and are rejected afterwards
+
+# %%
+DOCLING_WORKERS = int(os.environ.get("DOCLING_WORKERS", 2))
+DOCLING_TIMEOUT = float(os.environ.get("DOCLING_TIMEOUT", 120))
+DOCLING_MAX_PAGES = int(os.environ.get("DOCLING_MAX_PAGES", 30))
+DOCLING_MAX_FILE_MB = float(os.environ.get("DOCLING_MAX_FILE_MB", 20))
+DOCLING_QUEUE_SIZE = int(os.environ.get("DOCLING_QUEUE_SIZE", 8))
+DOCLING_QUEUE_TIMEOUT = float(os.environ.get("DOCLING_QUEUE_TIMEOUT", 30))
+
+class DocumentExtractionError(Exception):
+    "A document was rejected or couldn't be converted"
+
+_docling_pool : Optional[ProcessPoolExecutor] = None
+_docling_pool_lock = threading.Lock()
+_docling_slots = threading.BoundedSemaphore(max(DOCLING_WORKERS, 1) + DOCLING_QUEUE_SIZE)
+# documents waiting for a free worker wait here and not in the queue of the pool
+_docling_free_workers = threading.BoundedSemaphore(max(DOCLING_WORKERS, 1))
+
+def get_docling_pool() -> ProcessPoolExecutor:
+    "Return the pool of extraction workers, started from a fork server and not from the multi-threaded app process"
+    global _docling_pool
+    with _docling_pool_lock:
+        if _docling_pool is None:
+            import docling_worker
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["__main__", "docling_worker"])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _docling_pool = ProcessPoolExecutor(
+                max_workers=DOCLING_WORKERS,
+                mp_context=context,
+                initializer=docling_worker.init_worker
+            )
+        return _docling_pool
+
+def restart_docling_pool(pool : ProcessPoolExecutor):
+    "Terminate the workers of a pool with a hanging conversion, the next document starts a new pool"
+    global _docling_pool
+    with _docling_pool_lock:
+        if _docling_pool is pool:
+            _docling_pool = None
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def warm_up_docling_pool():
+    "Start all workers of the pool, each one loads the docling models once"
+    import docling_worker
+    pool = get_docling_pool()
+    try:
+        for future in [pool.submit(docling_worker.ping) for _ in range(DOCLING_WORKERS)]:
+            future.result()
+    except BrokenProcessPool:
+        # e. g. docling is not installed, the next document starts a new pool
+        restart_docling_pool(pool)
+        raise
+
+def convert_document(source : Union[str, Path]) -> str:
+    "Convert a document to Markdown within the size, page and time limits, in the worker pool if enabled"
+    size = Path(source).stat().st_size
+    if size > DOCLING_MAX_FILE_MB * 1024 * 1024:
+        metrics.inc("docling_conversions_total", status="rejected")
+        raise DocumentExtractionError(f"{Path(source).name} is larger than {DOCLING_MAX_FILE_MB:g} MB.")
+
+    queued = time.time()
+    if not _docling_slots.acquire(timeout=DOCLING_QUEUE_TIMEOUT):
+        metrics.inc("docling_conversions_total", status="rejected")
+        raise DocumentExtractionError("Too many documents are converted at the moment, please try again in a minute.")
+    try:
+        if DOCLING_WORKERS <= 0:
+            started = time.time()
+            result = get_document_converter().convert(Path(source), max_num_pages=DOCLING_MAX_PAGES, max_file_size=int(DOCLING_MAX_FILE_MB * 1024 * 1024))
+            markdown, seconds = result.document.export_to_markdown(), time.time() - started
+        else:
+            markdown, started, seconds = _convert_in_pool(source)
+    except DocumentExtractionError:
+        raise
+    except Exception as e:
+        metrics.inc("docling_conversions_total", status="error")
+        raise DocumentExtractionError(f"Converting {Path(source).name} failed: {e}") from e
+    finally:
+        _docling_slots.release()
+
+    metrics.inc("docling_conversions_total", status="ok")
+    metrics.observe("docling_queue_wait_seconds", max(started - queued, 0.0))
+    metrics.observe("docling_conversion_seconds", seconds)
+    return markdown
+
+def _convert_in_pool(source : Union[str, Path]) -> Tuple[str, float, float]:
+    "Run the conversion on a free worker of the pool, a pool broken by the timeout of another document is retried once"
+    import docling_worker
+    for attempt in range(2):
+        with _docling_free_workers:
+            pool = get_docling_pool()
+            future = pool.submit(docling_worker.convert_document, str(source), DOCLING_MAX_PAGES, int(DOCLING_MAX_FILE_MB * 1024 * 1024))
+            try:
+                # a worker is free, so the document doesn't wait in the pool and only a hanging conversion times out
+                return future.result(timeout=DOCLING_TIMEOUT)
+            except FutureTimeoutError:
+                restart_docling_pool(pool)
+                metrics.inc("docling_conversions_total", status="timeout")
+                raise DocumentExtractionError(f"Converting {Path(source).name} took longer than {DOCLING_TIMEOUT:g}s.")
+            except BrokenProcessPool:
+                restart_docling_pool(pool)
+                if attempt == 1:
+                    raise
+
+# %% [markdown]
+# ### Context retrieval
+# - The CV and the example cover letters are split into sections and ranked by their BM25 relevance to the job description when the information is extracted
+# - Agents only receive the most relevant sections within a token budget (in their original order), documents within the budget are passed completely
+# - The selection only depends on the job description, so all agents of a session still share the same prompt prefix
+
+# %%
+CONTEXT_CV_TOKEN_BUDGET = int(os.environ.get("CONTEXT_CV_TOKEN_BUDGET", 1500))
+CONTEXT_EXAMPLES_TOKEN_BUDGET = int(os.environ.get("CONTEXT_EXAMPLES_TOKEN_BUDGET", 1000))
+BM25_K1, BM25_B = 1.5, 0.75
+
+def split_sections(text : str, max_tokens : int) -> List[str]:
+    "Split a document at Markdown headings and split sections longer than max_tokens at paragraphs"
+    sections, current = [], []
+    for block in re.split(r"\n\s*\n", text):
+        # horizontal rules only separate sections
+        if not block.strip() or re.fullmatch(r"\s*(-{3,}|\*{3,})\s*", block):
+            continue
+        if re.match(r"\s*#{1,6} ", block) and current:
+            sections.append("\n\n".join(current))
+            current = []
+        current.append(block.strip())
+    if current:
+        sections.append("\n\n".join(current))
+
+    chunks = []
+    for section in sections:
+        chunk = ""
+        for paragraph in section.split("\n\n"):
+            if chunk and estimate_tokens(chunk + paragraph) > max_tokens:
+                chunks.append(chunk)
+                chunk = ""
+            chunk = f"{chunk}\n\n{paragraph}" if chunk else paragraph
+        chunks.append(chunk)
+    return chunks
+
+def tokenize(text : str) -> List[str]:
+    return [token for token in re.findall(r"\w+", text.lower()) if len(token) > 1]
+
+def bm25_scores(chunks : List[str], query : str) -> np.ndarray:
+    "BM25 relevance of every chunk to the query"
+    documents = [tokenize(chunk) for chunk in chunks]
+    vocabulary = {term: i for i, term in enumerate(sorted({term for document in documents for term in document}))}
+    term_frequencies = np.zeros((len(documents), len(vocabulary)))
+    for row, document in enumerate(documents):
+        np.add.at(term_frequencies[row], [vocabulary[term] for term in document], 1)
+
+    query_weights = np.zeros(len(vocabulary))
+    for term in tokenize(query):
+        if term in vocabulary:
+            query_weights[vocabulary[term]] += 1
+
+    lengths = term_frequencies.sum(axis=1, keepdims=True)
+    document_frequencies = (term_frequencies > 0).sum(axis=0)
+    idf = np.log(1 + (len(documents) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+    saturation = term_frequencies * (BM25_K1 + 1) / (term_frequencies + BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1)))
+    return saturation @ (idf * query_weights)
+
+def select_relevant_sections(text : str, query : str, token_budget : int, max_section_tokens : int, keep_first : bool = False) -> Tuple[str, Dict[str, int]]:
+    "Return the sections most relevant to the query within the token budget in their original order, and the selection statistics"
+    chunks = split_sections(text, max_section_tokens)
+    stats = {"sections": len(chunks), "selected": len(chunks), "tokens": estimate_tokens(text), "selected_tokens": estimate_tokens(text)}
+    if stats["tokens"] <= token_budget:
+        return text, stats
+
+    scores = bm25_scores(chunks, query)
+    # the first section of a CV holds the name and contact details
+    ranking = ([0] if keep_first else []) + [i for i in np.argsort(-scores, kind="stable").tolist() if not (keep_first and i == 0)]
+    selected, used = [], 0
+    for i in ranking:
+        tokens = estimate_tokens(chunks[i])
+        if used + tokens <= token_budget:
+            selected.append(i)
+            used += tokens
+    stats.update(selected=len(selected), selected_tokens=used)
+    return "\n\n[...]\n\n".join(chunks[i] for i in sorted(selected)), stats
+
+def index_session_documents(state : ApplicationAgentState) -> str:
+    "Select the relevant sections of the CV and the examples for the prompts, returns a summary for the logs"
+    # documents within the budget are not stored twice, the prompts fall back to the complete document
+    if state.context_mode != "retrieval" or not state.job_description:
+        state.cv_context, state.examples_context = "", ""
+        return ""
+
+    report = "Context retrieval:"
+    cv_context, stats = select_relevant_sections(state.cv, state.job_description, CONTEXT_CV_TOKEN_BUDGET, max_section_tokens=200, keep_first=True)
+    state.cv_context = cv_context if stats["selected"] < stats["sections"] else ""
+    report += f" CV {stats['selected']} of {stats['sections']} sections (~{stats['selected_tokens']} of ~{stats['tokens']} tokens)"
+    if state.examples:
+        examples_context, stats = select_relevant_sections(state.examples, state.job_description, CONTEXT_EXAMPLES_TOKEN_BUDGET, max_section_tokens=600)
+        state.examples_context = examples_context if stats["selected"] < stats["sections"] else ""
+        report += f", examples {stats['selected']} of {stats['sections']} sections (~{stats['selected_tokens']} of ~{stats['tokens']} tokens)"
+    return report
+
+# %% [markdown]
+# ### Prompt assembly
+# - The prompts of all agents in a session start with the same prefix: the general system prompt and the session context (job description, CV, motivation, examples)
+# - Role instructions, the message history and the task follow after the shared prefix, so providers can reuse their cached prefix across agents
+
+# %%
+def session_context(state : ApplicationAgentState) -> str:
+    "Return the information about the applicant and the position shared by all agents of a session"
+    retrieval = state.context_mode == "retrieval"
+    cv = state.cv_context if retrieval and state.cv_context else state.cv
+    examples = state.examples_context if retrieval and state.examples_context else state.examples
+    context = f"""
+[JOB DESCRIPTION]
+{state.job_description}
+[END JOB DESCRIPTION]
+
+[CV]
+{cv}
+[END CV]
+"""
+    if state.motivation:
+        context += f"\nThis is the general motivation and the desired job profiles of the applicant:\n[MOTIVATION]\n{state.motivation}\n[END MOTIVATION]\n"
+
+    if examples:
+        context += f"\nThese are previous cover letters of the applicant showing the personal writing style:\n[EXAMPLES]\n{examples}\n[END EXAMPLES]\n"
+
+    return context
+
+def build_agent_prompts(state : ApplicationAgentState, instructions : str, task : str, history_intro : str) -> Tuple[str, str]:
+    "Assemble the system and user prompt of an agent with the shared session prefix first and the agent-specific parts last"
+    system_prompt = general_prefix + session_context(state)
+
+    user_prompt = f"[YOUR ROLE]\n{instructions}\n[END YOUR ROLE]\n"
+    if len(state.messages):
+        user_prompt += history_intro
+        user_prompt += format_history(state, current_agent.get()) + "\n"
+
+    user_prompt += task
+    return system_prompt, user_prompt
+
+# %% [markdown]
+# ### Message history compaction
+# - In compact mode superseded drafts of the writer and superseded critiques are dropped, only the latest contribution of each agent is kept verbatim
+# - The history of every agent prompt is limited to a token budget: older contributions are truncated first, then dropped, the latest draft and feedback are only truncated as a last resort
+# - Histories that still exceed the budget (only possible with a budget of a few tokens) are logged and counted in the metrics
+
+# %%
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", 6000))
+# the final answer summarizes all contributions and gets a larger budget
+HISTORY_TOKEN_BUDGETS : Dict[str, int] = {
+    "final_answer_tool": 2 * HISTORY_TOKEN_BUDGET
+}
+
+_history_stats = {"full_tokens": 0, "compact_tokens": 0}
+_history_stats_lock = threading.Lock()
+
+def estimate_tokens(text : str) -> int:
+    "Rough token estimate of 4 characters per token"
+    return len(text) // 4
+
+TRUNCATION_MARK = " [...truncated]"
+MIN_TRUNCATED_CHARS = 200
+
+def history_tokens(messages : List[Tuple[str,str]]) -> int:
+    "Estimated tokens of the contents of a message history"
+    return sum(estimate_tokens(content) for _, content in messages)
+
+def compact_messages(messages : List[Tuple[str,str]], token_budget : int) -> List[Tuple[str,str]]:
+    "Keep the latest contribution of every agent (and all user queries), then truncate and drop the oldest ones to fit the budget"
+    latest = {}
+    for i, (role, content) in enumerate(messages):
+        latest[role] = i
+    superseded = {role: sum(1 for r, _ in messages if r == role) - 1 for role in latest}
+
+    kept = []
+    for i, (role, content) in enumerate(messages):
+        if role == "user query" or latest[role] == i:
+            if superseded.get(role) and role != "user query":
+                content = f"[{superseded[role]} earlier contribution(s) omitted]\n{content}"
+            kept.append((role, content))
+
+    def truncate(i : int, min_chars : int):
+        role, content = kept[i]
+        keep_chars = max(len(content) - (history_tokens(kept) - token_budget) * 4 - len(TRUNCATION_MARK), min_chars)
+        if keep_chars < len(content):
+            kept[i] = (role, content[:keep_chars] + TRUNCATION_MARK)
+
+    # the last two entries are the latest draft and feedback
+    older = max(len(kept) - 2, 0)
+    # 1. truncate the oldest contributions first
+    for i in range(older):
+        if history_tokens(kept) <= token_budget:
+            return kept
+        truncate(i, MIN_TRUNCATED_CHARS)
+
+    # 2. drop the oldest contributions
+    dropped = 0
+    while dropped < older and history_tokens(kept) > token_budget:
+        kept.pop(1 if dropped else 0)
+        if not dropped:
+            kept.insert(0, ("history", ""))
+        dropped += 1
+        kept[0] = ("history", f"[{dropped} older contribution(s) omitted to fit the token budget]")
+    if dropped:
+        metrics.inc("history_dropped_messages_total", dropped)
+
+    # 3. truncate the latest draft and feedback, the older one first
+    for i in range(len(kept) - min(len(kept), 2), len(kept)):
+        if history_tokens(kept) <= token_budget:
+            break
+        if kept[i][0] != "history":
+            truncate(i, 0)
+    return kept
+
+def format_history(state : ApplicationAgentState, agent : str) -> str:
+    "Return the message history for the prompt of an agent according to the history mode of the session"
+    full_history = serialize_messages(state.messages)
+    if state.history_mode == "full":
+        return full_history
+
+    token_budget = HISTORY_TOKEN_BUDGETS.get(agent, HISTORY_TOKEN_BUDGET)
+    messages = compact_messages(state.messages, token_budget)
+    if history_tokens(messages) > token_budget:
+        metrics.inc("history_budget_exceeded_total", agent=agent)
+        print(f"⚠️ History of {agent} exceeds its budget of {token_budget} tokens with ~{history_tokens(messages)} tokens")
+    history = serialize_messages(messages)
+
+    full_tokens, compact_tokens = estimate_tokens(full_history), estimate_tokens(history)
+    with _history_stats_lock:
+        _history_stats["full_tokens"] += full_tokens
+        _history_stats["compact_tokens"] += compact_tokens
+    if compact_tokens < full_tokens:
+        print(f"🗜️ History of {agent} compacted from ~{full_tokens} to ~{compact_tokens} tokens")
+    return history
+
+def history_stats() -> Dict[str, int]:
+    "Return the estimated prompt tokens of the history before and after compaction"
+    with _history_stats_lock:
+        return {**_history_stats, "saved_tokens": _history_stats["full_tokens"] - _history_stats["compact_tokens"]}
+
+# %% [markdown]
+# ### Cover letter linting
+# - Deterministic checks of the writer's rules run before the LLM critic: length, em-dashes, bullet points and numbers that are not stated in the inputs
+# - Drafts failing a check go straight back to the writer with the findings, only drafts passing all checks are reviewed by the LLM critic
+
+# %%
+CRITIC_LINT = os.environ.get("CRITIC_LINT", "on").lower() != "off"
+COVER_LETTER_MAX_WORDS = int(os.environ.get("COVER_LETTER_MAX_WORDS", 300))
+
+BULLET_PATTERN = re.compile(r"^\s*([-*•–]|\d+[.)])\s+", re.MULTILINE)
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+# dates (17.10.2026, 2026-10-17, 10/17/2026, 17. Oktober, October 17th) and years are no claims about the experience
+MONTH_NAMES = r"(?:Jan|Feb|Mar|Mär|Apr|May|Mai|Jun|Jul|Aug|Sep|Oct|Okt|Nov|Dec|Dez)[a-zä]*\.?"
+DATE_PATTERN = re.compile(
+    rf"\b\d{{1,4}}[./-]\d{{1,2}}[./-]\d{{2,4}}\b|\b\d{{1,2}}\.\d{{1,2}}\.(?!\d)|\b\d{{1,2}}(?:st|nd|rd|th|\.)?\s+{MONTH_NAMES}|\b{MONTH_NAMES}\s+\d{{1,2}}(?:st|nd|rd|th)?\b",
+    re.IGNORECASE
+)
+YEAR_PATTERN = re.compile(r"^(19|20)\d{2}$")
+
+_lint_stats = {"passed": 0, "failed": 0}
+_lint_stats_lock = threading.Lock()
+
+def extract_numbers(text : str) -> set:
+    "Numbers of a text without thousands separators, single digits, dates and years are ignored as they are often part of the wording"
+    numbers = {number.replace(",", "") for number in NUMBER_PATTERN.findall(DATE_PATTERN.sub(" ", text))}
+    return {number for number in numbers if len(number) > 1 and not YEAR_PATTERN.match(number)}
 
-    if USE_GOOGLE:
-        llm = ChatGoogleGenerativeAI(
-            model = MODEL_NAME,
-            google_api_key = API_KEY,
+def lint_cover_letter(draft : str, state : ApplicationAgentState) -> List[str]:
+    "Return the findings of the local checks of a cover letter draft, an empty list if the draft passes"
+    draft = strip_think_blocks(draft).strip()
+    findings = []
+
+    words = len(draft.split())
+    if words > COVER_LETTER_MAX_WORDS:
+        findings.append(f"The cover letter has {words} words, shorten it to at most {COVER_LETTER_MAX_WORDS} words.")
+
+    em_dashes = draft.count("—")
+    if em_dashes:
+        findings.append(f"Replace the {em_dashes} em-dash(es) (—) with commas, colons or separate sentences, they make the text look AI-generated.")
+
+    bullets = len(BULLET_PATTERN.findall(draft))
+    if bullets > 1:
+        findings.append(f"Write the cover letter as continuous text, replace the {bullets} bullet points or list items with paragraphs.")
+
+    sources = "\n".join([state.cv or "", state.job_description or "", state.motivation or "", state.examples or ""])
+    invented_numbers = sorted(extract_numbers(draft) - extract_numbers(sources))
+    if invented_numbers:
+        findings.append(f"Remove the numbers that are not stated in the CV, the job description or the motivation: {', '.join(invented_numbers)}.")
+
+    with _lint_stats_lock:
+        _lint_stats["failed" if findings else "passed"] += 1
+    metrics.inc("critic_lint_total", result="failed" if findings else "passed")
+    return findings
+
+def latest_draft(messages : List[Tuple[str,str]]) -> Optional[str]:
+    "Return the most recent cover letter of the writer agent"
+    return next((content for agent, content in reversed(messages) if agent == "writer_agent"), None)
+
+def lint_stats() -> Dict[str, int]:
+    "Number of drafts that passed or failed the local checks, every failed draft saved one LLM critic call"
+    with _lint_stats_lock:
+        return dict(_lint_stats)
+
+# %% [markdown]
+# ### Draft revision edits
+# - Revisions of the writer are returned as paragraph replacements and applied to the previous draft locally, so only the changed paragraphs are generated
+# - Edits that don't apply (unknown paragraphs, no edits at all) fall back to a full rewrite
+
+# %%
+_revision_stats = {
+    "rewrite": {"count": 0, "seconds": 0.0, "tokens": 0},
+    "edits": {"count": 0, "seconds": 0.0, "tokens": 0},
+    "fallbacks": 0
+}
+_revision_stats_lock = threading.Lock()
+
+def split_paragraphs(text : str) -> List[str]:
+    "Split a draft into its paragraphs separated by blank lines"
+    return [paragraph.strip() for paragraph in re.split(r"\n\s*\n", text) if paragraph.strip()]
+
+def number_paragraphs(paragraphs : List[str]) -> str:
+    "Return the paragraphs with their numbers to reference them in edits"
+    return "\n\n".join(f"[{i}] {paragraph}" for i, paragraph in enumerate(paragraphs, 1))
+
+def apply_draft_edits(paragraphs : List[str], edits : List[ParagraphEdit]) -> Optional[str]:
+    "Apply the paragraph replacements to a draft, returns None if the edits can't be applied"
+    if not edits:
+        return None
+    revised = list(paragraphs)
+    for edit in edits:
+        if not 1 <= edit.paragraph <= len(paragraphs):
+            return None
+        revised[edit.paragraph - 1] = edit.text.strip()
+    return "\n\n".join(paragraph for paragraph in revised if paragraph)
+
+def record_revision(mode : str, seconds : float, output_tokens : int) -> str:
+    "Record a writer draft and return the comparison of an edit-based revision with the average full rewrite"
+    with _revision_stats_lock:
+        stats = _revision_stats[mode]
+        stats["count"] += 1
+        stats["seconds"] += seconds
+        stats["tokens"] += output_tokens
+        rewrite = dict(_revision_stats["rewrite"])
+    metrics.observe("writer_draft_seconds", seconds, mode=mode)
+    metrics.inc("writer_draft_output_tokens_total", output_tokens, mode=mode)
+    if mode != "edits" or not rewrite["count"]:
+        return ""
+    return f" (a full rewrite takes ~{rewrite['tokens'] // rewrite['count']} output tokens and {rewrite['seconds'] / rewrite['count']:.2f}s on average)"
+
+def record_revision_fallback():
+    "Count edits that couldn't be applied and were replaced by a full rewrite"
+    with _revision_stats_lock:
+        _revision_stats["fallbacks"] += 1
+    metrics.inc("writer_edit_fallbacks_total")
+
+def revision_stats() -> Dict[str, Any]:
+    "Statistics of the writer drafts by mode: full rewrites and edit-based revisions"
+    with _revision_stats_lock:
+        return {key: dict(value) if isinstance(value, dict) else value for key, value in _revision_stats.items()}
+
+# %% [markdown]
+# ### Model tiers
+# - Planning, critique and the final answer are short structured or summarising calls, they use the `fast` tier; the writer and the assessments use the `strong` tier
+# - The model and provider of each tier and the tier of each agent are configurable, a session can use the `strong` or the `fast` model for all agents in the Advanced options
+# - Calls, latency, tokens and cost are reported per tier in the logs and the metrics
+
+# %%
+MODEL_TIERS : Dict[str, Tuple[str, str]] = {
+    "strong": ("google" if USE_GOOGLE else "nebius", MODEL_NAME),
+    "fast": (
+        os.environ.get("FAST_MODEL_PROVIDER", "google" if USE_GOOGLE else "nebius").lower(),
+        os.environ.get("FAST_MODEL_NAME", MODEL_NAME)
+    ),
+}
+AGENT_MODEL_TIERS : Dict[str, str] = {
+    "orchestrator_agent": "fast",
+    "critic_agent": "fast",
+    "final_answer_tool": "fast",
+    "recruiter_agent": "strong",
+    "team_lead_agent": "strong",
+    "writer_agent": "strong",
+    "interview_agent": "strong",
+    **json.loads(os.environ.get("AGENT_MODEL_TIERS", "{}"))
+}
+# the API key of each provider, a tier may use another provider than the one selected by the available keys
+PROVIDER_API_KEYS = {"nebius": os.environ.get("NEBIUS_KEY"), "google": os.environ.get("GOOGLE_API_KEY")}
+for agent, tier in AGENT_MODEL_TIERS.items():
+    if tier not in MODEL_TIERS:
+        raise ValueError(f"Unknown model tier {tier} of {agent} in AGENT_MODEL_TIERS, use one of {', '.join(MODEL_TIERS)}")
+for tier, (provider, model_name) in MODEL_TIERS.items():
+    if provider not in PROVIDER_API_KEYS:
+        raise ValueError(f"Unknown provider {provider} of the {tier} tier, use one of {', '.join(PROVIDER_API_KEYS)}")
+    if provider != MODEL_TIERS["strong"][0] and "FAST_MODEL_NAME" not in os.environ:
+        raise ValueError(f"Set FAST_MODEL_NAME to a model of {provider}, the fast tier uses another provider than the strong tier")
+    if LLM_MODE != "replay" and not PROVIDER_API_KEYS[provider]:
+        raise ValueError(f"No API key for {provider}, the provider of the {tier} tier: set {'GOOGLE_API_KEY' if provider == 'google' else 'NEBIUS_KEY'}")
+
+# Model tiers of the session whose agent is executed: tiered, strong or fast
+session_model_tiers : contextvars.ContextVar[str] = contextvars.ContextVar("session_model_tiers", default="tiered")
+_tier_stats : Dict[str, Dict[str, float]] = {}
+_tier_stats_lock = threading.Lock()
+
+def agent_model_tier(agent : str) -> str:
+    "Tier of an agent in the current session, calls outside of the agents use the strong tier"
+    mode = session_model_tiers.get()
+    if mode != "tiered":
+        return mode
+    return AGENT_MODEL_TIERS.get(agent, "strong")
+
+def llm_target(agent : Optional[str] = None) -> Tuple[str, str]:
+    "Return the provider and model of the tier of the agent, by default of the agent whose node is executed"
+    return MODEL_TIERS[agent_model_tier(agent or current_agent.get())]
+
+def llm_labels() -> Dict[str, str]:
+    "Metric labels of a call of the current agent"
+    agent = current_agent.get()
+    provider, model_name = llm_target(agent)
+    return {"agent": agent, "tier": agent_model_tier(agent), "provider": provider, "model": model_name}
+
+def record_tier_call(tier : str, duration : float, usage : Dict[str, int], cost : float):
+    "Add a completed call to the statistics of its tier"
+    with _tier_stats_lock:
+        stats = _tier_stats.setdefault(tier, {"calls": 0, "seconds": 0.0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0})
+        stats["calls"] += 1
+        stats["seconds"] += duration
+        stats["input_tokens"] += usage["input"]
+        stats["output_tokens"] += usage["output"]
+        stats["cost"] += cost
+
+def tier_stats() -> Dict[str, Dict[str, float]]:
+    with _tier_stats_lock:
+        return {tier: dict(stats) for tier, stats in _tier_stats.items()}
+
+# %% [markdown]
+# ### LLM client pool
+# - Chat models and prebuilt chains are created once per provider, model and response format and shared by all sessions
+# - The chat models keep a keep-alive connection pool, so consecutive agent calls reuse warm connections
+# - The async HTTP client of a chat model is bound to the event loop that used it first, so every event loop (Gradio, job queue, batch) gets its own chat models and chains
+
+# %%
+# retries are handled by call_llm (and not by the SDKs) to count them in the metrics
+LLM_MAX_RETRIES = {
+    "google": int(os.environ.get("LLM_MAX_RETRIES", 3)),
+    "nebius": int(os.environ.get("LLM_MAX_RETRIES", 3))
+}
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 60))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", 0.5))
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", 30))
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+def is_retryable_error(error : Exception) -> bool:
+    "Whether a failed call is worth retrying: timeouts, connection errors, rate limits and server errors"
+    status_code = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status_code, int):
+        return status_code in RETRYABLE_STATUS_CODES
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError, TimeoutError, ConnectionError)):
+        return True
+    return any(name in error.__class__.__name__ for name in ("Timeout", "Connection", "RateLimit", "ResourceExhausted", "ServiceUnavailable"))
+
+def is_rate_limit_error(error : Exception) -> bool:
+    "Whether the provider rejected the call because of its rate limits"
+    status_code = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status_code == 429 or any(name in error.__class__.__name__ for name in ("RateLimit", "ResourceExhausted"))
+
+def retry_delay(attempt : int, error : Optional[Exception] = None) -> float:
+    "Exponential backoff with full jitter between retries, a Retry-After header of the provider is respected"
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return max(delay, min(LLM_BACKOFF_MAX, float(headers.get("retry-after", 0))))
+    except (TypeError, ValueError):
+        return delay
+
+LLM_POOL_MAX_CONNECTIONS = int(os.environ.get("LLM_POOL_MAX_CONNECTIONS", 100))
+LLM_POOL_MAX_KEEPALIVE = int(os.environ.get("LLM_POOL_MAX_KEEPALIVE", 20))
+
+llm_prompt_template = ChatPromptTemplate.from_messages([
+    ("system", "{system_prompt}"),
+    ("user", "{user_prompt}")
+])
+
+# chat models and chains of the calls without a running event loop and per event loop
+_sync_llm_pool : Dict[str, Dict[Tuple[str, ...], Any]] = {"chat_models": {}, "chains": {}}
+_loop_llm_pools : "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Dict[Tuple[str, ...], Any]]]" = weakref.WeakKeyDictionary()
+_llm_pool_lock = threading.Lock()
+_llm_pool_stats = {"hits": 0, "misses": 0}
+
+def create_chat_model(provider : str, model_name : str) -> Any:
+    "Create a chat model for the provider backed by a keep-alive connection pool"
+    if provider == "google":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(
+            model = model_name,
+            google_api_key = PROVIDER_API_KEYS["google"],
             temperature = 0,
             max_tokens = None,
-            timeout = None,
-            max_retries = 2
+            timeout = LLM_TIMEOUT,
+            max_retries = 0
         )
-    else:
-        llm = ChatOpenAI(
-        model=MODEL_NAME,
-        api_key=API_KEY,
+
+    from langchain_openai import ChatOpenAI
+    limits = httpx.Limits(
+        max_connections=LLM_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE
+    )
+    return ChatOpenAI(
+        model=model_name,
+        api_key=PROVIDER_API_KEYS["nebius"],
         base_url=ENDPOINT_URL,
         max_completion_tokens=None,
-        timeout=60,
+        timeout=LLM_TIMEOUT,
         max_retries=0,
-        temperature=0
-        )
-    
-    if response_format is not None:  
-        llm = llm.with_structured_output(response_format)
+        temperature=0,
+        http_client=httpx.Client(limits=limits, timeout=LLM_TIMEOUT),
+        http_async_client=httpx.AsyncClient(limits=limits, timeout=LLM_TIMEOUT)
+    )
+
+def _current_llm_pool() -> Dict[str, Dict[Tuple[str, ...], Any]]:
+    "Return the chat models and chains of the running event loop, the caller has to hold the pool lock"
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _sync_llm_pool
+    pool = _loop_llm_pools.get(loop)
+    if pool is None:
+        pool = {"chat_models": {}, "chains": {}}
+        _loop_llm_pools[loop] = pool
+    return pool
+
+def get_llm_chain(response_format : Any = None, target : Optional[Tuple[str, str]] = None) -> Any:
+    "Return the pooled prompt | model chain for the provider and model of the current agent (or the given target) and the response format"
+    provider, model_name = target or llm_target()
+    format_name = response_format.__name__ if response_format is not None else "text"
+    key = (provider, model_name, format_name)
+
+    with _llm_pool_lock:
+        chains = _current_llm_pool()["chains"]
+        chain = chains.get(key)
+        if chain is not None:
+            _llm_pool_stats["hits"] += 1
+            return chain
+
+        _llm_pool_stats["misses"] += 1
+        llm = _get_chat_model(provider, model_name)
+
+        if response_format is not None:
+            # the raw message is kept to report the token usage
+            llm = llm.with_structured_output(response_format, include_raw=True)
+
+        chain = llm_prompt_template | llm
+        chains[key] = chain
+
+    return chain
+
+def _get_chat_model(provider : str, model_name : str) -> Any:
+    "Return the pooled chat model of the running event loop, the caller has to hold the pool lock"
+    chat_models = _current_llm_pool()["chat_models"]
+    llm = chat_models.get((provider, model_name))
+    if llm is None:
+        llm = create_chat_model(provider, model_name)
+        chat_models[(provider, model_name)] = llm
+    return llm
+
+def llm_pool_stats() -> Dict[str, int]:
+    "Return the hit/miss counts and size of the LLM client pool"
+    with _llm_pool_lock:
+        pools = [_sync_llm_pool, *_loop_llm_pools.values()]
+        return {
+            **_llm_pool_stats,
+            "event_loops": len(pools) - 1,
+            "chat_models": sum(len(pool["chat_models"]) for pool in pools),
+            "chains": sum(len(pool["chains"]) for pool in pools)
+        }
+
+# %% [markdown]
+# ### Client-side rate limiting
+# - A token bucket per provider limits the requests and tokens per minute of all sessions in the process, calls wait in front of the bucket instead of running into 429s
+# - The number of concurrent calls adapts: it is halved on rate limit errors and grows back by one after a full window of successful calls
+# - The queueing delay in front of the limiter is recorded in the metrics
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "{system_prompt}"),
-        ("user", "{user_prompt}")
-    ])
+# %%
+LLM_RPM = float(os.environ.get("LLM_RPM", 0))
+LLM_TPM = float(os.environ.get("LLM_TPM", 0))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 32))
+LLM_MIN_CONCURRENCY = 1
+# output tokens reserved per call, settled with the reported usage after the call
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.environ.get("LLM_EXPECTED_OUTPUT_TOKENS", 500))
+LIMITER_POLL_INTERVAL = 0.02
+
+class ProviderRateLimiter:
+    "Token buckets for the requests and tokens per minute and an adaptive limit of concurrent calls of one provider"
+
+    def __init__(self, provider : str, rpm : float, tpm : float, max_concurrency : int):
+        self.provider = provider
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = rpm
+        self.tokens = tpm
+        self.updated = time.monotonic()
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self.updated = now - self.updated, now
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def try_acquire(self, tokens : int) -> float:
+        "Take a slot and the budget of one call, returns 0 on success or the seconds to wait before trying again"
+        with self._lock:
+            self._refill()
+            if self.in_flight >= int(self.concurrency):
+                return LIMITER_POLL_INTERVAL
+            # a call larger than the bucket would never fit
+            tokens = min(tokens, self.tpm)
+            waits = [0.0]
+            if self.rpm and self.requests < 1:
+                waits.append((1 - self.requests) * 60 / self.rpm)
+            if self.tpm and self.tokens < tokens:
+                waits.append((tokens - self.tokens) * 60 / self.tpm)
+            if max(waits) > 0:
+                return max(max(waits), LIMITER_POLL_INTERVAL)
+            self.requests -= 1
+            self.tokens -= tokens
+            self.in_flight += 1
+            return 0.0
+
+    def release(self, reserved : int, used : int, rate_limited : bool):
+        "Free the slot, settle the reserved tokens with the used ones and adapt the concurrency limit"
+        with self._lock:
+            self.in_flight -= 1
+            if self.tpm and used:
+                self.tokens = min(self.tpm, self.tokens + min(reserved, self.tpm) - used)
+            if rate_limited:
+                self.concurrency = max(LLM_MIN_CONCURRENCY, self.concurrency / 2)
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            concurrency = self.concurrency
+        metrics.set("llm_concurrency_limit", int(concurrency), provider=self.provider)
+
+_rate_limiters : Dict[str, ProviderRateLimiter] = {}
+
+def rate_limiter(provider : str) -> ProviderRateLimiter:
+    "Return the process-wide rate limiter of the provider"
+    with _llm_pool_lock:
+        if provider not in _rate_limiters:
+            _rate_limiters[provider] = ProviderRateLimiter(provider, LLM_RPM, LLM_TPM, LLM_MAX_CONCURRENCY)
+        return _rate_limiters[provider]
+
+def record_queue_delay(provider : str, delay : float):
+    "Record the time a call waited for the rate limiter"
+    metrics.observe("llm_queue_delay_seconds", delay, provider=provider)
+    if delay >= 1:
+        print(f"⏳ {current_agent.get()}: waited {delay:.2f}s for the rate limiter")
+
+def acquire_llm_slot(provider : str, tokens : int) -> float:
+    "Block until the rate limiter admits the call and return the queueing delay"
+    limiter = rate_limiter(provider)
+    start = time.perf_counter()
+    while (wait := limiter.try_acquire(tokens)) > 0:
+        time.sleep(wait)
+    delay = time.perf_counter() - start
+    record_queue_delay(provider, delay)
+    return delay
+
+async def aacquire_llm_slot(provider : str, tokens : int) -> float:
+    "Async variant of acquire_llm_slot, waiting calls don't block the event loop"
+    limiter = rate_limiter(provider)
+    start = time.perf_counter()
+    while (wait := limiter.try_acquire(tokens)) > 0:
+        await asyncio.sleep(wait)
+    delay = time.perf_counter() - start
+    record_queue_delay(provider, delay)
+    return delay
+
+def release_llm_slot(provider : str, tokens : int, response : Any = None, error : Optional[Exception] = None):
+    "Release the slot of a finished call with the reported token usage"
+    rate_limited = error is not None and is_rate_limit_error(error)
+    if rate_limited:
+        metrics.inc("llm_rate_limited_total", **llm_labels())
+    usage = token_usage(response["raw"] if isinstance(response, dict) else response) if response is not None else {"input": 0, "output": 0}
+    rate_limiter(provider).release(tokens, usage["input"] + usage["output"], rate_limited)
 
-    chain = prompt | llm
+# %% [markdown]
+# ### Gemini context caching
+# - Optional explicit context caching for the Google API (`GEMINI_CONTEXT_CACHE=on`)
+# - The shared prefix of a session (system prompt + session context) is uploaded once and referenced by all agent calls
 
-    response = chain.invoke({
-        "system_prompt":system_prompt,
-        "user_prompt": user_prompt
-    })
+# %%
+GEMINI_CONTEXT_CACHE = USE_GOOGLE and os.environ.get("GEMINI_CONTEXT_CACHE", "off").lower() in ("on", "true", "1")
+GEMINI_CONTEXT_CACHE_TTL = int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", 3600))
+# Gemini rejects context caches below a minimum size, shorter prefixes are sent as usual
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("GEMINI_CONTEXT_CACHE_MIN_TOKENS", 1024))
+
+cached_content_prompt_template = ChatPromptTemplate.from_messages([
+    ("user", "{user_prompt}")
+])
+
+_gemini_context_caches : Dict[str, Tuple[Optional[str], float]] = {}
+_gemini_context_cache_lock = threading.Lock()
+# one lock per prompt, only calls with the same prompt wait for the creation of its cache
+_gemini_context_cache_key_locks : Dict[str, threading.Lock] = {}
+
+def gemini_cached_content(system_prompt : str) -> Optional[str]:
+    "Return the name of the Gemini context cache holding the system prompt, creating it if required"
+    # rough estimate of 4 characters per token
+    if len(system_prompt) / 4 < GEMINI_CONTEXT_CACHE_MIN_TOKENS:
+        return None
+
+    model_name = llm_target()[1]
+    key = hashlib.sha256(f"{model_name}\n{system_prompt}".encode("utf-8")).hexdigest()
+    with _gemini_context_cache_lock:
+        key_lock = _gemini_context_cache_key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        with _gemini_context_cache_lock:
+            name, expires = _gemini_context_caches.get(key, (None, 0.0))
+        # renew the cache shortly before it expires
+        if time.time() < expires - 60:
+            return name
 
-    return response 
+        try:
+            from google import genai
+            from google.genai import types
+            client = genai.Client(api_key=PROVIDER_API_KEYS["google"])
+            cache = client.caches.create(
+                model=model_name,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_prompt,
+                    display_name=f"application-assistant-{key[:12]}",
+                    ttl=f"{GEMINI_CONTEXT_CACHE_TTL}s"
+                )
+            )
+            name = cache.name
+        except Exception as e:
+            # don't retry a failing prefix on every call
+            print(f"Creating the Gemini context cache failed, sending the full prompt: {e}")
+            name = None
+        with _gemini_context_cache_lock:
+            _gemini_context_caches[key] = (name, time.time() + GEMINI_CONTEXT_CACHE_TTL)
+        return name
 
-def serialize_messages(messages : List[Tuple[str,str]]) -> str:
-    "Returns a formatted message history of previous messages"
-    return "\n" +"\n".join(f"{role}:\n{content}" for role, content in messages)
+def get_cached_content_chain(cached_content : str, response_format : Any = None) -> Any:
+    "Return a chain that references the Gemini context cache instead of sending the system prompt"
+    provider, model_name = llm_target()
+    with _llm_pool_lock:
+        # the copy shares the client and its connections with the pooled model
+        llm = _get_chat_model(provider, model_name).model_copy(update={"cached_content": cached_content})
 
-def strip_think_blocks(text: str) -> str:
-    return re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+    if response_format is not None:
+        llm = llm.with_structured_output(response_format, include_raw=True)
+
+    return cached_content_prompt_template | llm
+
+# %% [markdown]
+# ### LLM response cache
+# - All calls use `temperature=0`, so identical requests are answered from the cache instead of the provider
+# - Two tiers: an in-memory LRU for the hot entries and a SQLite file shared by all processes and restarts
+# - The responses contain CVs and cover letters, so by default they are only kept in memory; `LLM_CACHE=disk` also persists them in the SQLite tier, `LLM_CACHE=off` bypasses the cache
+
+# %%
+LLM_CACHE_MODE = os.environ.get("LLM_CACHE", "memory").lower()
+LLM_CACHE_ENABLED = LLM_CACHE_MODE not in ("off", "false", "0")
+LLM_CACHE_PERSISTENT = LLM_CACHE_MODE in ("disk", "on", "true", "1")
+LLM_CACHE_PATH = Path(os.environ.get("LLM_CACHE_PATH", ".cache/llm_responses.sqlite"))
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MEMORY_ENTRIES = int(os.environ.get("LLM_CACHE_MEMORY_ENTRIES", 256))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 10000))
+
+def llm_cache_key(system_prompt : str, user_prompt : str, response_format : Any = None) -> str:
+    "Hash of everything that determines the response: provider, model, prompts and output schema"
+    provider, model_name = llm_target()
+    schema = response_format.model_json_schema() if response_format is not None else None
+    request = json.dumps([provider, model_name, system_prompt, user_prompt, schema], sort_keys=True)
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+class LLMResponseCache:
+    "Exact-match response cache with an in-memory LRU tier and an optional SQLite tier, both with TTL and size-based eviction"
+
+    def __init__(self, path : Path, ttl : float, memory_entries : int, max_entries : int, persistent : bool = False):
+        self.path = path
+        self.persistent = persistent
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self._memory : OrderedDict[str, Tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def _db(self) -> sqlite3.Connection:
+        "Open the SQLite tier on first use"
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        return self._connection
+
+    @staticmethod
+    def _serialize(response : Any) -> str:
+        if isinstance(response, AIMessage):
+            return json.dumps({"type": "text", "content": response.content})
+        return json.dumps({"type": "structured", "data": response.model_dump()})
+
+    @staticmethod
+    def _deserialize(value : str, response_format : Any) -> Any:
+        entry = json.loads(value)
+        if entry["type"] == "structured":
+            return response_format.model_validate(entry["data"])
+        return AIMessage(content=entry["content"])
+
+    def _remember(self, key : str, created : float, value : str):
+        "Insert into the memory tier and evict the least recently used entries"
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key : str, response_format : Any = None) -> Any:
+        "Return the cached response or None"
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return self._deserialize(entry[1], response_format)
+            self._memory.pop(key, None)
+            if not self.persistent:
+                self._stats["misses"] += 1
+                return None
+
+            row = self._db().execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db().execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db().commit()
+                self._stats["misses"] += 1
+                return None
+
+            self._db().execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db().commit()
+            self._remember(key, row[1], row[0])
+            self._stats["disk_hits"] += 1
+            return self._deserialize(row[0], response_format)
+
+    def put(self, key : str, response : Any):
+        "Store a response in both tiers, failed structured outputs (None) are not cached"
+        if response is None:
+            return
+        value = self._serialize(response)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if not self.persistent:
+                return
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)", (key, value, now, now))
+            evicted = db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,)).rowcount
+            count = db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                evicted += db.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                    (count - self.max_entries,)
+                ).rowcount
+            db.commit()
+            self._stats["evictions"] += evicted
+
+    def stats(self) -> Dict[str, int]:
+        "Return the hit/miss/eviction counts of the cache"
+        with self._lock:
+            return dict(self._stats)
+
+llm_response_cache = LLMResponseCache(LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MEMORY_ENTRIES, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_PERSISTENT)
+
+def runtime_stats_report() -> str:
+    "Return the statistics of the LLM client pool and response cache for the logs, they are counted over all sessions of the process"
+    pool_stats = llm_pool_stats()
+    report = "\n📈 Process-wide statistics (all sessions since the start of the app):\n"
+    report += f"♻️ LLM client pool: {pool_stats['hits']} hits, {pool_stats['misses']} misses\n"
+    drafts = lint_stats()
+    if drafts["failed"]:
+        report += f"🧹 Cover letter linting: {drafts['failed']} of {drafts['failed'] + drafts['passed']} drafts sent back without the LLM critic ({drafts['failed']} LLM calls avoided)\n"
+    revisions = revision_stats()
+    if revisions["edits"]["count"]:
+        report += f"✂️ Edit-based revisions: {revisions['edits']['count']} applied, {revisions['fallbacks']} fell back to a full rewrite\n"
+    plans = planner_stats()
+    if sum(plans.values()):
+        report += f"⚡ Fast-path planner: {plans.get('rule', 0)} rule hits, {plans.get('table', 0)} plan table hits, {plans.get('llm', 0)} LLM plans ({(plans.get('rule', 0) + plans.get('table', 0)) / sum(plans.values()):.0%} hit rate)\n"
+    artifacts = artifact_stats()
+    if artifacts["reused"]:
+        report += f"♻️ Agent artifacts: {artifacts['reused']} agent runs reused from earlier queries, {artifacts['stored']} stored\n"
+    checkpoints = checkpoint_stats()
+    if checkpoints["resumed"]:
+        report += f"♻️ Checkpoints: {checkpoints['resumed']} runs resumed, {checkpoints['nodes']} agent runs skipped (~{checkpoints['seconds']:.1f}s and {checkpoints['tokens']} tokens saved)\n"
+    tiers = tier_stats()
+    if tiers:
+        report += "🎚️ Model tiers: " + ", ".join(
+            f"{tier} ({MODEL_TIERS[tier][1]}) {stats['calls']} calls, {stats['seconds'] / stats['calls']:.2f}s per call, {stats['input_tokens'] + stats['output_tokens']} tokens, ${stats['cost']:.4f}"
+            for tier, stats in sorted(tiers.items())
+        ) + "\n"
+    saved_tokens = history_stats()["saved_tokens"]
+    if saved_tokens:
+        report += f"🗜️ History compaction: ~{saved_tokens} prompt tokens saved\n"
+    if LLM_CACHE_ENABLED:
+        cache_stats = llm_response_cache.stats()
+        report += f"🗄️ LLM response cache: {cache_stats['memory_hits']} memory hits, {cache_stats['disk_hits']} disk hits, {cache_stats['misses']} misses\n"
+    return report
+
+# %% [markdown]
+# ### Record/replay of LLM calls
+# - `LLM_MODE=record` writes every request and response to the cassette file `LLM_CASSETTE`
+# - `LLM_MODE=replay` serves the recorded responses without API key or network access, e. g. for benchmarks and regression runs
+# - `LLM_REPLAY_LATENCY` simulates the latency of each replayed call in seconds, `recorded` replays the recorded latency
+
+# %%
+LLM_CASSETTE = Path(os.environ.get("LLM_CASSETTE", ".cache/llm_cassette.jsonl"))
+LLM_REPLAY_LATENCY = os.environ.get("LLM_REPLAY_LATENCY", "0")
+
+class LLMCassette:
+    "JSONL recording of LLM calls, identical requests are replayed in the recorded order"
+
+    def __init__(self, path : Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries : Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._replayed : Dict[str, int] = {}
+
+    @staticmethod
+    def request_key(system_prompt : str, user_prompt : str, response_format : Any = None) -> str:
+        "Hash of the request, independent of provider and model so cassettes replay without API key"
+        schema = response_format.model_json_schema() if response_format is not None else None
+        request = json.dumps([system_prompt, user_prompt, schema], sort_keys=True)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def record(self, system_prompt : str, user_prompt : str, response_format : Any, response : Any, usage : Optional[Dict[str, int]] = None, duration : float = 0.0):
+        "Append a call to the cassette"
+        entry = {
+            "key": self.request_key(system_prompt, user_prompt, response_format),
+            "agent": current_agent.get(),
+            "response_format": response_format.__name__ if response_format is not None else None,
+            # a structured output that failed to parse is recorded as None and replayed as such
+            "response": response.content if isinstance(response, AIMessage) else response.model_dump() if response is not None else None,
+            "usage": usage or {"input": 0, "cached": 0, "output": 0},
+            "duration": duration
+        }
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as cassette:
+                cassette.write(json.dumps(entry) + "\n")
+
+    def replay(self, system_prompt : str, user_prompt : str, response_format : Any = None) -> Tuple[Any, float]:
+        "Return the recorded raw response (as returned by the chain) and the latency to simulate"
+        key = self.request_key(system_prompt, user_prompt, response_format)
+        with self._lock:
+            if self._entries is None:
+                self._entries = {}
+                for line in self.path.read_text(encoding="utf-8").splitlines():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+            recordings = self._entries.get(key)
+            if not recordings:
+                raise LookupError(f"No recorded response of {current_agent.get()} for this request in {self.path}")
+            index = self._replayed.get(key, 0)
+            self._replayed[key] = index + 1
+            entry = recordings[index % len(recordings)]
+
+        usage = entry["usage"]
+        message = AIMessage(
+            content=entry["response"] if response_format is None else "",
+            usage_metadata={
+                "input_tokens": usage["input"],
+                "output_tokens": usage["output"],
+                "total_tokens": usage["input"] + usage["output"],
+                "input_token_details": {"cache_read": usage["cached"]}
+            }
+        )
+        parsed = response_format.model_validate(entry["response"]) if response_format is not None and entry["response"] is not None else None
+        raw_response = message if response_format is None else {"raw": message, "parsed": parsed}
+        duration = entry["duration"] if LLM_REPLAY_LATENCY == "recorded" else float(LLM_REPLAY_LATENCY)
+        return raw_response, duration
+
+llm_cassette = LLMCassette(LLM_CASSETTE)
 
 # %% [markdown]
 # ### Gradio utilities
 
 # %%
+_session_log : contextvars.ContextVar[Optional[StringIO]] = contextvars.ContextVar("session_log", default=None)
+
+class SessionStdout:
+    "Stdout proxy writing prints into the log buffer of the current session, so that concurrent runs don't mix their logs"
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text : str) -> int:
+        buffer = _session_log.get()
+        return (buffer if buffer is not None else self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name : str) -> Any:
+        return getattr(self.stream, name)
+
+def session_log_context() -> Tuple[contextvars.Context, StringIO]:
+    "Return a copy of the current context that captures all prints into a new log buffer"
+    if not isinstance(sys.stdout, SessionStdout):
+        sys.stdout = SessionStdout(sys.stdout)
+    buffer = StringIO()
+    context = contextvars.copy_context()
+    context.run(_session_log.set, buffer)
+    return context, buffer
+
 # Handle different result types cleanly
+SESSION_STATE_DEFAULTS = {name: field.default for name, field in ApplicationAgentState.model_fields.items()}
+
+def session_state_dict(values : Dict[str, Any]) -> Dict[str, Any]:
+    "Compact session state: only the per-user fields that differ from their defaults"
+    return {
+        name: value for name, value in values.items()
+        if name in SESSION_STATE_DEFAULTS and value != SESSION_STATE_DEFAULTS[name]
+    }
+
 def type_conversion(obj : Any, type):
     "Return the object in a gradio compatible type"
     if isinstance(obj, type):
-        result_dict = obj.model_dump()
+        result_dict = obj.model_dump(exclude_defaults=True)
     elif isinstance(obj, Dict):
-        result_dict = obj
+        result_dict = session_state_dict(obj)
     else:
         # Handle possible dataclass or similar object
         try:
-            result_dict = ApplicationAgentState.model_validate(obj).model_dump()
+            result_dict = ApplicationAgentState.model_validate(obj).model_dump(exclude_defaults=True)
         except Exception as e:
             print(f"Error converting output of type {type(obj)}")
 
@@ -537,30 +2214,137 @@ def type_conversion(obj : Any, type):
 # %% [markdown]
 # ## Agents
 
+# %% [markdown]
+# ### Agent runner
+# - Agents are written as generators that yield their LLM calls, so the same agent runs in the sync and in the async graph
+# - `run_agent` executes the calls with `call_llm`, `arun_agent` awaits them with `acall_llm`
+# - An agent can yield a list of calls, they are executed concurrently and the responses are sent back as a list
+
+# %%
+class LLMCall(NamedTuple):
+    "LLM request yielded by an agent and executed by the agent runner"
+    system_prompt : str
+    user_prompt : str
+    response_format : Any = None
+
+# Name of the agent whose node is currently executed, used to attribute LLM calls
+current_agent : contextvars.ContextVar[str] = contextvars.ContextVar("current_agent", default="llm")
+# tokens used by the running graph node, shared with the threads of its parallel LLM calls
+node_usage : contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar("node_usage", default=None)
+_node_usage_lock = threading.Lock()
+
+def add_node_usage(usage : Dict[str, int]):
+    "Add the token usage of an LLM call to the running graph node"
+    totals = node_usage.get()
+    if totals is not None:
+        with _node_usage_lock:
+            totals["input"] += usage["input"]
+            totals["output"] += usage["output"]
+
+def node_output_tokens() -> int:
+    "Output tokens of the LLM calls of the running graph node so far, as reported by the provider"
+    totals = node_usage.get()
+    if totals is None:
+        return 0
+    with _node_usage_lock:
+        return totals["output"]
+
+def run_llm_calls(request : Union[LLMCall, List[LLMCall]]) -> Any:
+    "Execute a call or a list of calls in worker threads, every thread keeps the context of the agent (logs, metrics)"
+    if isinstance(request, LLMCall):
+        return call_llm(*request)
+    with ThreadPoolExecutor(max_workers=len(request)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, call_llm, *call) for call in request]
+        return [future.result() for future in futures]
+
+async def arun_llm_calls(request : Union[LLMCall, List[LLMCall]]) -> Any:
+    "Await a call or a list of concurrent calls"
+    if isinstance(request, LLMCall):
+        return await acall_llm(*request)
+    return list(await asyncio.gather(*(acall_llm(*call) for call in request)))
+
+def run_agent(agent : Callable, state : ApplicationAgentState, thread_id : Optional[str] = None) -> Command:
+    "Run an agent and execute its LLM calls synchronously"
+    token = current_agent.set(agent.__name__)
+    tiers_token = session_model_tiers.set(state.model_tiers)
+    usage_token = node_usage.set({"input": 0, "output": 0})
+    start, status = time.perf_counter(), "error"
+    steps = agent(state)
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(run_llm_calls(request))
+    except StopIteration as result:
+        status = "ok"
+        return result.value
+    finally:
+        record_node_run(agent.__name__, time.perf_counter() - start, status, thread_id)
+        node_usage.reset(usage_token)
+        session_model_tiers.reset(tiers_token)
+        current_agent.reset(token)
+
+async def arun_agent(agent : Callable, state : ApplicationAgentState, thread_id : Optional[str] = None) -> Command:
+    "Run an agent and await its LLM calls"
+    token = current_agent.set(agent.__name__)
+    tiers_token = session_model_tiers.set(state.model_tiers)
+    usage_token = node_usage.set({"input": 0, "output": 0})
+    start, status = time.perf_counter(), "error"
+    steps = agent(state)
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(await arun_llm_calls(request))
+    except StopIteration as result:
+        status = "ok"
+        return result.value
+    finally:
+        record_node_run(agent.__name__, time.perf_counter() - start, status, thread_id)
+        node_usage.reset(usage_token)
+        session_model_tiers.reset(tiers_token)
+        current_agent.reset(token)
+
+def record_node_run(agent : str, duration : float, status : str, thread_id : Optional[str] = None):
+    "Record the latency of a graph node, completed nodes of a checkpointed run are added to its progress"
+    metrics.inc("agent_node_runs_total", agent=agent, status=status)
+    metrics.observe("agent_node_duration_seconds", duration, agent=agent)
+    if status == "ok" and thread_id:
+        record_checkpoint_progress(thread_id, duration, node_usage.get())
+
+def agent_node(agent : Callable) -> RunnableLambda:
+    "Wrap an agent as a graph node supporting invoke/stream as well as ainvoke/astream"
+    def node(state : ApplicationAgentState, config : RunnableConfig) -> Command:
+        return run_agent(agent, state, config.get("configurable", {}).get("thread_id"))
+
+    async def anode(state : ApplicationAgentState, config : RunnableConfig) -> Command:
+        return await arun_agent(agent, state, config.get("configurable", {}).get("thread_id"))
+
+    return RunnableLambda(node, afunc=anode, name=agent.__name__)
+
 # %% [markdown]
 # ### Orchestrator agent
 # 
 # 
 
 # %%
-def orchestrator_agent(state: ApplicationAgentState) -> Command[Literal["recruiter_agent", "team_lead_agent", "writer_agent", "critic_agent", "interview_agent","final_answer_tool", END]]:
+def orchestrator_agent(state: ApplicationAgentState) -> Generator[LLMCall, Any, Command[Literal["recruiter_agent", "team_lead_agent", "writer_agent", "critic_agent", "interview_agent","final_answer_tool", END]]]:
     """
     Central orchestration logic to determine which agent to call next based on the current state and results.
     """
 
     # check if the CV and a job description are provided by the user
     if not state.cv or not state.job_description:
-        state.final_answer = "### ❗️ The application assisant needs more information about you and the desired position to provide high-quality results.\n" \
+        final_answer = "### ❗️ The application assisant needs more information about you and the desired position to provide high-quality results.\n" \
         "👈🏽 Please go to the tab 🤗 **Personal Information** and provide your CV and the job description."  
         return Command(
             goto=END,
-            update=state
+            update={"final_answer": final_answer}
         )
     
+    update = {}
     if state.phase == "PLAN":
         agent_descriptions = "\n".join([
             f"{agent.get('title')}\nDescription: {agent.get('description')}"
-            for name, agent in state.available_agents.items()
+            for name, agent in AGENT_REGISTRY.items()
         ])
         system_prompt = f"""You are an orchestrator agent, that delegates tasks to specialized agents based on a user query.
 
@@ -594,10 +2378,14 @@ def orchestrator_agent(state: ApplicationAgentState) -> Command[Literal["recruit
         """
 
         user_prompt = state.user_query
-        state.messages.append(("user query", state.user_query))
-
-        # call the orchestrator to select the next agent 
-        response = call_llm(system_prompt, user_prompt, MultiStepPlan)
+        update["messages"] = [("user query", state.user_query)]
+
+        # common queries are planned locally, otherwise the orchestrator selects the next agent
+        response = fast_path_plan(state.user_query) if FAST_PLANNER else None
+        if response is None:
+            response = yield LLMCall(system_prompt, user_prompt, MultiStepPlan)
+            if FAST_PLANNER:
+                remember_plan(state.user_query, response)
         print("="*40)
         print("🤖 ORCHESTRATOR PLAN")
         print("="*40)
@@ -605,150 +2393,191 @@ def orchestrator_agent(state: ApplicationAgentState) -> Command[Literal["recruit
         print("🔗 Planned Steps:")
         for i, step in enumerate(response.plan, 1):
             print(f"  {i}. {step}")
+        plan, reused = reuse_artifacts(response.plan, state)
+        if reused:
+            update["messages"] += reused
+            print(f"\n♻️ Reusing {len(reused)} agent results of an earlier query: {', '.join(agent for agent, _ in reused)}")
         print("="*40)
         print("⚙️ EXECUTE PLAN")
         print("="*40 + "\n")
-        state.plan = response.plan
-        state.phase = "EXECUTE"
-    
-    if len(state.plan) == 0 and state.phase == "EXECUTE":
-        state.phase = "ANSWER"
-        return Command(
-            goto="final_answer_tool",
-            update=state
-        )
+        state.plan = plan
+        state.phase = update["phase"] = "EXECUTE"
+        # every query gets a fresh budget for the writer/critic loop
+        update["iterations"] = 0
+
     if state.phase == "EXECUTE":
-        # return next agent to call
-        agent = state.plan.pop(0)
-        try: 
+        if len(state.executing) > 1:
+            # agents of the last step finished in arbitrary order, restore the order of the plan
+            update["messages"] = [RESET_MESSAGES] + order_parallel_contributions(state.messages, state.executing)
+
+        steps, remaining_plan = schedule_next_steps(state.plan)
+        update.update(plan=remaining_plan, executing=steps)
+
+        if len(steps) == 0:
+            update["phase"] = "ANSWER"
             return Command(
-                goto=agent,
-                update=state)
-        except Exception as e:
-            print(f"Error executing the plan in step {i} - {step}: {e}")
+                goto="final_answer_tool",
+                update=update
+            )
+
+        if len(steps) > 1:
+            print(f"⏩ Running {', '.join(steps)} in parallel")
+
+        # return next agents to call
+        return Command(
+            goto=steps if len(steps) > 1 else steps[0],
+            update=update
+        )
 
     if state.phase == "ANSWER":
-        state.phase = "PLAN"
-        state.messages = [("orchestrator_agent", f"Final answer:\n{state.final_answer}")]
+        update.update(
+            phase="PLAN",
+            messages=[RESET_MESSAGES, ("orchestrator_agent", f"Final answer:\n{state.final_answer}")]
+        )
         
     # finally end the workflow execution
-    return Command(goto=END, update=state)
+    return Command(goto=END, update=update)
+
+def order_parallel_contributions(messages : List[Tuple[str,str]], agents : List[str]) -> List[Tuple[str,str]]:
+    "Sort the trailing contributions of agents executed in parallel in the order of the plan"
+    start = len(messages)
+    while start > 0 and messages[start - 1][0] in agents:
+        start -= 1
+    contributions = sorted(messages[start:], key=lambda message: agents.index(message[0]))
+    return list(messages[:start]) + contributions
 
 # %% [markdown]
 # ### Recruiter agent
 
 # %%
-def recruiter_agent(state : ApplicationAgentState) -> Command:
+def recruiter_agent(state : ApplicationAgentState) -> Generator[LLMCall, Any, Command[Literal["orchestrator_agent"]]]:
     "The recruiter agent has the task to provide feedback about the applicant from the perspective of a senior recruiter"
 
-    agent_description = state.available_agents.get("recruiter_agent", {})
-    system_prompt = agent_description.get("system_prompt", "You're a Senior recruiter agent that provides feedback about an applicant.")
+    agent_description = AGENT_REGISTRY.get("recruiter_agent", {})
+    instructions = agent_description.get("instructions", "You're a Senior recruiter agent that provides feedback about an applicant.")
     
-    user_prompt = f"""
-[JOB DESCRIPTION]
-{state.job_description}
-[END JOB DESCRIPTION]
-
-[CV]
-{state.cv}
-[END CV]
-    """
-
-    if len(state.messages):
-        user_prompt += "Other agents have already contributed to the task. Please use their contributions to improve your feedback for the applicant."
-        user_prompt += serialize_messages(state.messages)
-
-    user_prompt += "Provide feedback on the applicant from your perspective."
+    system_prompt, user_prompt = build_agent_prompts(
+        state,
+        instructions,
+        task="Provide feedback on the applicant from your perspective.",
+        history_intro="Other agents have already contributed to the task. Please use their contributions to improve your feedback for the applicant."
+    )
 
     print("The recruiter agent assesses your information to provide feedback 🧑🏼‍💻")
-    response = call_llm(system_prompt, user_prompt).content
+    response = (yield LLMCall(system_prompt, user_prompt)).content
     print("The recruiter agent has provided feedback.")
 
     agent_contribution = ("recruiter_agent", response)
-    state.messages.append(agent_contribution)
     
     return Command(
         goto="orchestrator_agent",
-        update=state
+        update={"messages": [agent_contribution], "artifacts": store_artifact("recruiter_agent", state, response)}
     )
 
 # %% [markdown]
 # ### Team lead agent
 
 # %%
-def team_lead_agent(state : ApplicationAgentState) -> Command:
+def team_lead_agent(state : ApplicationAgentState) -> Generator[LLMCall, Any, Command[Literal["orchestrator_agent"]]]:
     "The team lead agent has the task to provide feedback about the applicant from the perspective of the team lead of the hiring team"
 
-    agent_description = state.available_agents.get("team_lead_agent", {})
-    system_prompt = agent_description.get("system_prompt", "You're a team lead and you want to hire a new person. Provide feedback on the applicant.")
+    agent_description = AGENT_REGISTRY.get("team_lead_agent", {})
+    instructions = agent_description.get("instructions", "You're a team lead and you want to hire a new person. Provide feedback on the applicant.")
     
-    user_prompt = f"""
-[JOB DESCRIPTION]
-{state.job_description}
-[END JOB DESCRIPTION]
-
-[CV]
-{state.cv}
-[END CV]
-    """
-
-    if len(state.messages):
-        user_prompt += "Other agents have already contributed to the task. Please use their contributions to improve your feedback for the applicant."
-        user_prompt += serialize_messages(state.messages)
-
-    user_prompt += "Provide feedback on the applicant from your perspective."
+    system_prompt, user_prompt = build_agent_prompts(
+        state,
+        instructions,
+        task="Provide feedback on the applicant from your perspective.",
+        history_intro="Other agents have already contributed to the task. Please use their contributions to improve your feedback for the applicant."
+    )
 
     print("The team lead agent assesses your information to provide feedback 🧑🏼‍💻")
-    response = call_llm(system_prompt, user_prompt).content
+    response = (yield LLMCall(system_prompt, user_prompt)).content
     print("The team lead agent has provided feedback.")
 
     agent_contribution = ("team_lead_agent", response)
-    state.messages.append(agent_contribution)
     
     return Command(
         goto="orchestrator_agent",
-        update=state
+        update={"messages": [agent_contribution], "artifacts": store_artifact("team_lead_agent", state, response)}
     )
 
 # %% [markdown]
 # ### Writer agent
 
 # %%
-def writer_agent(state: ApplicationAgentState) -> Command[Literal["critic_agent"]]:
+# emphasis of the drafts in the best-of-n drafting mode, the drafts only differ in the end of the user prompt
+DRAFT_EMPHASES = [
+    "Emphasize the technical skills and achievements from the CV that match the job description.",
+    "Emphasize the motivation for the role and the fit with the mission and culture of the company.",
+    "Emphasize the impact of previous projects and how it transfers to the responsibilities of the role.",
+    "Keep the cover letter especially concise and direct.",
+    "Emphasize the soft skills and the collaboration with other teams."
+]
+
+def writer_agent(state: ApplicationAgentState) -> Generator[LLMCall, Any, Command[Literal["critic_agent"]]]:
     """Generate a cover letter using job description, CV, motivation, and skill match."""
     
-    agent_description = state.available_agents.get("writer_agent", {})
-    system_prompt = agent_description.get("system_prompt", "You're a critic agent that provides helpful feedback for cover letters.")
-    
-    user_prompt = f"""
-[JOB DESCRIPTION]
-{state.job_description}
-[END JOB DESCRIPTION]
-
-[CV]
-{state.cv}
-[END CV]
-    """
-
-    if state.motivation != "":
-        user_prompt += f"\nThis is my general motivation and my desired job profiles:\n[MOTIVATION]{state.motivation}\n[END MOTIVATION]\n"
-
-    if state.examples != "":
-        user_prompt += f"Use the following examples of previous cover letters to adapt to my personal writing style:\n[EXAMPLES]\n{state.examples}\n[END EXAMPLES]\n"
+    agent_description = AGENT_REGISTRY.get("writer_agent", {})
+    instructions = agent_description.get("instructions", "You're a writer agent that writes cover letters.")
+    history_intro = "Other agents have already contributed to the task. Please use their contributions to improve your writing."
+
+    # a revision after feedback of the critic only replaces the affected paragraphs
+    previous_draft = latest_draft(state.messages)
+    if state.revision_mode == "edits" and previous_draft and state.messages[-1][0] == "critic_agent":
+        paragraphs = split_paragraphs(strip_think_blocks(previous_draft))
+        system_prompt, user_prompt = build_agent_prompts(
+            state,
+            instructions,
+            task=f"Revise your previous cover letter according to the latest feedback. Only return replacements for the paragraphs that have to change and keep all other paragraphs as they are. The revised cover letter has to stay under 300 words.\n\n[PREVIOUS DRAFT]\n{number_paragraphs(paragraphs)}\n[END PREVIOUS DRAFT]",
+            history_intro=history_intro
+        )
+        print("The writer agent revises the paragraphs addressed by the feedback ✏️")
+        start, output_before = time.perf_counter(), node_output_tokens()
+        response = yield LLMCall(system_prompt, user_prompt, DraftEdits)
+        seconds = time.perf_counter() - start
+        # a failed structured output (None) falls back to a full rewrite like edits that can't be applied
+        draft = apply_draft_edits(paragraphs, response.edits) if response is not None else None
+        if draft is not None:
+            # cached responses and providers without usage metadata report no tokens, they are estimated from the response
+            output_tokens = node_output_tokens() - output_before or estimate_tokens(response.model_dump_json())
+            comparison = record_revision("edits", seconds, output_tokens)
+            print(f"✂️ {len(response.edits)} paragraph edit(s) applied in {seconds:.2f}s with {output_tokens} output tokens{comparison}")
+            return Command(
+                goto="critic_agent",
+                update={"messages": [("writer_agent", draft)], "cover_letter": strip_think_blocks(draft).strip()}
+            )
+        record_revision_fallback()
+        print("The edits of the writer agent couldn't be applied, falling back to a full rewrite")
+
+    system_prompt, user_prompt = build_agent_prompts(
+        state,
+        instructions,
+        task="Use the examples of previous cover letters (if available) to adapt to my personal writing style. Write a professional cover letter in under 300 words in the language of the job description.",
+        history_intro=history_intro
+    )
+    if state.drafting_mode == "best_of_n" and state.num_drafts > 1:
+        print(f"The writer agent writes {state.num_drafts} cover letter drafts in parallel ✏️")
+        calls = [
+            LLMCall(system_prompt, f"{user_prompt}\n{DRAFT_EMPHASES[i % len(DRAFT_EMPHASES)]}")
+            for i in range(state.num_drafts)
+        ]
+        drafts = [response.content for response in (yield calls)]
+        print(f"The writer agent has completed {len(drafts)} drafts for your cover letter 📝")
+        return Command(
+            goto="critic_agent",
+            update={"drafts": drafts}
+        )
 
-    if len(state.messages):
-        user_prompt += "Other agents have already contributed to the task. Please use their contributions to improve your writing."
-        user_prompt += serialize_messages(state.messages)
-    
-    user_prompt += "Write a professional cover letter in under 300 words in the language of the job description."
     print("The writer agent writes the cover letter ✏️")
-    agent_contribution = ("writer_agent", call_llm(system_prompt, user_prompt).content)
+    start, output_before = time.perf_counter(), node_output_tokens()
+    agent_contribution = ("writer_agent", (yield LLMCall(system_prompt, user_prompt)).content)
+    record_revision("rewrite", time.perf_counter() - start, node_output_tokens() - output_before or estimate_tokens(agent_contribution[1]))
     print("The writer agent has completed a draft for your cover letter 📝")
-    state.messages.append(agent_contribution)
 
     return Command(
         goto="critic_agent",
-        update=state
+        update={"messages": [agent_contribution], "cover_letter": strip_think_blocks(agent_contribution[1]).strip()}
     )
 
 
@@ -757,36 +2586,28 @@ def writer_agent(state: ApplicationAgentState) -> Command[Literal["critic_agent"
 # ### Interview agent
 
 # %%
-def interview_agent(state : ApplicationAgentState) -> Command[Literal["orchestrator_agent"]]:
+def interview_agent(state : ApplicationAgentState) -> Generator[LLMCall, Any, Command[Literal["orchestrator_agent"]]]:
     "Agent to generate interview questions based on the provided feedback of a recruiter of team lead agent."
 
-    agent_description = state.available_agents.get("interview_agent", {})
-    system_prompt = agent_description.get("system_prompt", "You're an interview agent, that generates questions for an applicant in a job interview.")
+    agent_description = AGENT_REGISTRY.get("interview_agent", {})
+    instructions = agent_description.get("instructions", "You're an interview agent, that generates questions for an applicant in a job interview.")
     
-    user_prompt = f"""
-[JOB DE SCRIPTION]
-{state.job_description}
-[END JOB DESCRIPTION]
-
-[CV]
-{state.cv}
-[END CV]
-    """
-
-    if len(state.messages):
-        user_prompt += "Other agents have already contributed to the task. Please use their contributions to improve the quality of your interview questions."
-        user_prompt += serialize_messages(state.messages)
+    system_prompt, user_prompt = build_agent_prompts(
+        state,
+        instructions,
+        task="Generate the interview questions.",
+        history_intro="Other agents have already contributed to the task. Please use their contributions to improve the quality of your interview questions."
+    )
 
     print("The interview agent is generating a set of high-quality interview questions ❓")
-    response =  call_llm(system_prompt, user_prompt).content
+    response = (yield LLMCall(system_prompt, user_prompt)).content
     print("The interview agent has generated a set of interview questions. ")
 
     agent_contribution = ("interview_agent", response)
-    state.messages.append(agent_contribution)
 
     return Command(
         goto="orchestrator_agent",
-        update=state
+        update={"messages": [agent_contribution]}
     )
 
 
@@ -794,41 +2615,35 @@ def interview_agent(state : ApplicationAgentState) -> Command[Literal["orchestra
 # ### Critic agent
 
 # %%
-def critic_agent(state: ApplicationAgentState) -> Command[Literal["writer_agent","orchestrator_agent"]]:
+def critic_agent(state: ApplicationAgentState) -> Generator[LLMCall, Any, Command[Literal["writer_agent","orchestrator_agent"]]]:
     "Provide feedback for a previously written cover letter."
 
-    agent_contribution = ("critic_agent", "The critic agent was here..")
-
-    user_prompt = f"""
-[JOB DESCRIPTION]
-{state.job_description}
-[END JOB DESCRIPTION]
-
-[CV]
-{state.cv}
-[END CV]
-You are only allowed to make suggestions like quantifying experience if the required information was provided in the CV and is based on the actual experience. 
-"""
-    if state.motivation != "":
-        user_prompt += f"\nThis is my general motivation and my desired job profiles:\n[MOTIVATION]{state.motivation}\n[END MOTIVATION]\n"
-
-    if state.examples != "":
-        user_prompt += f"Use the following examples of previous cover letters to adapt to my personal writing style:\n[EXAMPLES]\n{state.examples}\n[END EXAMPLES]\n"
+    if state.drafts:
+        return (yield from rank_drafts(state))
 
-    if len(state.messages):
-        user_prompt += "Other agents have already contributed to the task. Please use their contributions to provide feedback to the most recent cover letter."
-        user_prompt += serialize_messages(state.messages)
-
-    agent_description = state.available_agents.get("critic_agent", {})
-    system_prompt = agent_description.get("system_prompt", "You're a critic agent that provides helpful feedback for cover letters.")
-    
     print("The critic agent revises the cover letter 🔎📝")
-    response = call_llm(system_prompt, user_prompt, Feedback)
+    draft = latest_draft(state.messages) if CRITIC_LINT else None
+    findings = lint_cover_letter(draft, state) if draft else []
+    if findings:
+        # obvious rule violations go back to the writer without an LLM call
+        print(f"🧹 The draft failed {len(findings)} local check(s), skipping the LLM critic")
+        response = Feedback(feedback="\n".join(f"- {finding}" for finding in findings), quality_flag="NEEDS IMPROVEMENT")
+    else:
+        agent_description = AGENT_REGISTRY.get("critic_agent", {})
+        instructions = agent_description.get("instructions", "You're a critic agent that provides helpful feedback for cover letters.")
+
+        system_prompt, user_prompt = build_agent_prompts(
+            state,
+            instructions,
+            task="Provide feedback to the most recent cover letter. You are only allowed to make suggestions like quantifying experience if the required information was provided in the CV and is based on the actual experience.",
+            history_intro="Other agents have already contributed to the task. Please use their contributions to provide feedback to the most recent cover letter."
+        )
+        response = yield LLMCall(system_prompt, user_prompt, Feedback)
     print("The critic agent revised the cover letter ✅")
 
     state.iterations += 1
 
-    if response.quality_flag == "PERFECT" or state.iterations == state.max_iterations:
+    if response.quality_flag == "PERFECT" or state.iterations >= state.max_iterations:
         next_step = "orchestrator_agent"
     else:
         next_step = "writer_agent"
@@ -836,16 +2651,48 @@ You are only allowed to make suggestions like quantifying experience if the requ
     print(f"[{state.iterations}. Iteration]\nFEEDBACK: {response.quality_flag}")
 
     agent_contribution = ("critic_agent", f"{response.feedback}")
-    
-    state.messages.append(agent_contribution)
 
     return Command(
         goto=next_step,
-        update=state
+        update={"messages": [agent_contribution], "feedback": response.feedback, "iterations": state.iterations}
+    )
+
+def rank_drafts(state : ApplicationAgentState) -> Generator[LLMCall, Any, Command[Literal["orchestrator_agent"]]]:
+    "Rank the drafts of the best-of-n drafting mode with a single critic call and keep the best one"
+    print(f"The critic agent ranks {len(state.drafts)} cover letter drafts 🔎📝")
+    # drafts failing the local checks are only considered if no draft passes
+    candidates = [i for i, draft in enumerate(state.drafts) if not (CRITIC_LINT and lint_cover_letter(draft, state))]
+    if not candidates:
+        candidates = list(range(len(state.drafts)))
+    elif len(candidates) < len(state.drafts):
+        print(f"🧹 {len(state.drafts) - len(candidates)} draft(s) failed the local checks and are not ranked")
+
+    agent_description = AGENT_REGISTRY.get("critic_agent", {})
+    instructions = agent_description.get("instructions", "You're a critic agent that provides helpful feedback for cover letters.")
+    drafts = "\n\n".join(f"[DRAFT {number}]\n{strip_think_blocks(state.drafts[i]).strip()}\n[END DRAFT {number}]" for number, i in enumerate(candidates, 1))
+    system_prompt, user_prompt = build_agent_prompts(
+        state,
+        instructions,
+        task=f"Compare the following {len(candidates)} cover letter drafts, select the best one and provide feedback to it. You are only allowed to make suggestions like quantifying experience if the required information was provided in the CV and is based on the actual experience.\n\n{drafts}",
+        history_intro="Other agents have already contributed to the task. Please use their contributions to rank the cover letter drafts."
+    )
+    response = yield LLMCall(system_prompt, user_prompt, DraftRanking)
+    best = candidates[min(max(response.best_draft, 1), len(candidates)) - 1]
+    print(f"🏆 The critic agent selected draft {best + 1} of {len(state.drafts)}")
+
+    return Command(
+        goto="orchestrator_agent",
+        update={
+            "messages": [("writer_agent", state.drafts[best]), ("critic_agent", response.feedback)],
+            "cover_letter": strip_think_blocks(state.drafts[best]).strip(),
+            "feedback": response.feedback,
+            "drafts": [],
+            "iterations": state.iterations + 1
+        }
     )
 
 # %%
-def final_answer_tool(state : ApplicationAgentState) -> Command[Literal["orchestrator_agent"]]:
+def final_answer_tool(state : ApplicationAgentState) -> Generator[LLMCall, Any, Command[Literal["orchestrator_agent"]]]:
     "Final answer tool is invoked to formulate a final answer based on the agent message history"
 
     system_prompt = f"""
@@ -856,7 +2703,7 @@ def final_answer_tool(state : ApplicationAgentState) -> Command[Literal["orchest
     ## Final answer
     """
 
-    formatted_history = serialize_messages(state.messages)
+    formatted_history = format_history(state, "final_answer_tool")
     
     user_prompt = f"""
     ---
@@ -867,35 +2714,169 @@ def final_answer_tool(state : ApplicationAgentState) -> Command[Literal["orchest
     {formatted_history}
     """
 
-    final_answer = call_llm(system_prompt, user_prompt).content
+    final_answer = (yield LLMCall(system_prompt, user_prompt)).content
 
+    update = {}
     if isinstance(final_answer, str):
-        final_answer = strip_think_blocks(final_answer)
-        state.final_answer = final_answer
+        update["final_answer"] = strip_think_blocks(final_answer)
     
     return Command(
         goto="orchestrator_agent",
-        update=state
+        update=update
     )
 
 
+# %% [markdown]
+# ### Checkpointing
+# - Graph runs are checkpointed after every step to a local SQLite file, the thread id is derived from the session and the state the query was submitted with
+# - Submitting the same query again after a failed or interrupted run (provider timeout, browser reconnect, crashed batch) resumes it at the last completed step instead of calling all agents again
+# - Checkpoints of completed runs are deleted right away, interrupted runs are pruned after `CHECKPOINT_TTL` seconds
+# - The checkpoints contain the CVs and drafts of the sessions, set `CHECKPOINTS=on` to enable them
+
+# %%
+CHECKPOINTS_ENABLED = os.environ.get("CHECKPOINTS", "off").lower() in ("on", "true", "1")
+CHECKPOINT_PATH = Path(os.environ.get("CHECKPOINT_PATH", ".cache/checkpoints.sqlite"))
+CHECKPOINT_TTL = float(os.environ.get("CHECKPOINT_TTL", 24 * 3600))
+CHECKPOINT_PRUNE_INTERVAL = 300
+
+class ThreadedSqliteSaver(SqliteSaver):
+    "SQLite checkpointer for the sync and the async graph, the async methods run the sync ones in a worker thread"
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        for checkpoint in await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit))):
+            yield checkpoint
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+def create_checkpointer(path : Path) -> ThreadedSqliteSaver:
+    "Open the checkpoint database with a table for the progress of the checkpointed runs"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path, check_same_thread=False)
+    # with WAL, NORMAL only syncs at checkpoints of the journal, a power loss may lose the latest step but never corrupts the file
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    checkpointer = ThreadedSqliteSaver(connection)
+    checkpointer.setup()
+    with checkpointer.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS run_progress (thread_id TEXT PRIMARY KEY, updated REAL NOT NULL, "
+            "nodes INTEGER NOT NULL DEFAULT 0, seconds REAL NOT NULL DEFAULT 0, input_tokens INTEGER NOT NULL DEFAULT 0, output_tokens INTEGER NOT NULL DEFAULT 0)"
+        )
+    return checkpointer
+
+checkpointer = create_checkpointer(CHECKPOINT_PATH) if CHECKPOINTS_ENABLED else None
+_last_checkpoint_prune = 0.0
+_checkpoint_prune_lock = threading.Lock()
+_checkpoint_stats = {"resumed": 0, "nodes": 0, "seconds": 0.0, "tokens": 0}
+_checkpoint_stats_lock = threading.Lock()
+
+def checkpoint_thread_id(state : ApplicationAgentState) -> str:
+    "Thread id of a run: the session and a hash of the state including the query, so only a retry of the same query resumes"
+    if not state.session_id:
+        # without a session there is nothing to resume
+        return f"anonymous:{uuid.uuid4().hex}"
+    values = json.dumps(state.model_dump(exclude_defaults=True), sort_keys=True, default=str)
+    return f"{state.session_id}:{hashlib.sha256(values.encode('utf-8')).hexdigest()[:16]}"
+
+def record_checkpoint_progress(thread_id : str, seconds : float, usage : Optional[Dict[str, int]]):
+    "Add a completed node to the progress of a checkpointed run"
+    usage = usage or {"input": 0, "output": 0}
+    with checkpointer.cursor() as cursor:
+        cursor.execute(
+            "UPDATE run_progress SET updated = ?, nodes = nodes + 1, seconds = seconds + ?, input_tokens = input_tokens + ?, output_tokens = output_tokens + ? WHERE thread_id = ?",
+            (time.time(), seconds, usage["input"], usage["output"], thread_id)
+        )
+
+def delete_checkpoints(thread_id : str):
+    "Delete the checkpoints and the progress of a run"
+    checkpointer.delete_thread(thread_id)
+    with checkpointer.cursor() as cursor:
+        cursor.execute("DELETE FROM run_progress WHERE thread_id = ?", (thread_id,))
+
+def prune_checkpoints():
+    "Delete interrupted runs that were not resumed within the TTL, at most every few minutes"
+    global _last_checkpoint_prune
+    now = time.time()
+    # concurrent runs must not prune at the same time
+    with _checkpoint_prune_lock:
+        if now - _last_checkpoint_prune < CHECKPOINT_PRUNE_INTERVAL:
+            return
+        _last_checkpoint_prune = now
+    with checkpointer.cursor(transaction=False) as cursor:
+        expired = [row[0] for row in cursor.execute("SELECT thread_id FROM run_progress WHERE updated < ?", (now - CHECKPOINT_TTL,))]
+    for thread_id in expired:
+        delete_checkpoints(thread_id)
+    if expired:
+        print(f"🧹 Pruned the checkpoints of {len(expired)} interrupted runs")
+
+def start_checkpointed_run(state : ApplicationAgentState) -> Tuple[Optional[ApplicationAgentState], Dict]:
+    "Return the graph input and config of a run, the input is None if an interrupted run of the same query is resumed"
+    if checkpointer is None:
+        return state, {}
+    prune_checkpoints()
+    thread_id = checkpoint_thread_id(state)
+    config = {"configurable": {"thread_id": thread_id}}
+    snapshot = graph.get_state(config)
+    if snapshot.next:
+        with checkpointer.cursor(transaction=False) as cursor:
+            nodes, seconds, input_tokens, output_tokens = cursor.execute(
+                "SELECT nodes, seconds, input_tokens, output_tokens FROM run_progress WHERE thread_id = ?", (thread_id,)
+            ).fetchone() or (0, 0.0, 0, 0)
+        with _checkpoint_stats_lock:
+            _checkpoint_stats["resumed"] += 1
+            _checkpoint_stats["nodes"] += nodes
+            _checkpoint_stats["seconds"] += seconds
+            _checkpoint_stats["tokens"] += input_tokens + output_tokens
+        metrics.inc("checkpoint_resumed_runs_total")
+        metrics.inc("checkpoint_saved_seconds_total", seconds)
+        metrics.inc("checkpoint_saved_tokens_total", input_tokens, kind="input")
+        metrics.inc("checkpoint_saved_tokens_total", output_tokens, kind="output")
+        print(f"♻️ Resuming the interrupted run at {', '.join(snapshot.next)}: {nodes} completed agent runs restored from the checkpoint (~{seconds:.1f}s, {input_tokens} input and {output_tokens} output tokens saved)\n")
+        return None, config
+
+    if snapshot.values:
+        # the same query was already answered, e. g. the result didn't reach the browser, run it again
+        delete_checkpoints(thread_id)
+    with checkpointer.cursor() as cursor:
+        cursor.execute("INSERT OR REPLACE INTO run_progress (thread_id, updated) VALUES (?, ?)", (thread_id, time.time()))
+    return state, config
+
+def finish_checkpointed_run(config : Dict):
+    "Delete the checkpoints of a completed run, the result is part of the session state"
+    if config:
+        delete_checkpoints(config["configurable"]["thread_id"])
+
+def checkpoint_stats() -> Dict[str, float]:
+    with _checkpoint_stats_lock:
+        return dict(_checkpoint_stats)
+
 # %% [markdown]
 # ## Build Graph
 
 # %%
 builder = StateGraph(ApplicationAgentState)
 
-builder.add_node(orchestrator_agent)
-builder.add_node(recruiter_agent)
-builder.add_node(team_lead_agent)
-builder.add_node(writer_agent)
-builder.add_node(critic_agent)
-builder.add_node(interview_agent)
-builder.add_node(final_answer_tool)
+builder.add_node("orchestrator_agent", agent_node(orchestrator_agent))
+builder.add_node("recruiter_agent", agent_node(recruiter_agent))
+builder.add_node("team_lead_agent", agent_node(team_lead_agent))
+builder.add_node("writer_agent", agent_node(writer_agent))
+builder.add_node("critic_agent", agent_node(critic_agent))
+builder.add_node("interview_agent", agent_node(interview_agent))
+builder.add_node("final_answer_tool", agent_node(final_answer_tool))
 
 builder.add_edge(START, "orchestrator_agent")
 
-graph = builder.compile()
+graph = builder.compile(checkpointer=checkpointer)
 
 # %% [markdown]
 # ## Gradio functions
@@ -910,7 +2891,13 @@ def extract_information(
     job_description_file,
     motivation_file,
     examples_file,
-    max_iterations: int
+    max_iterations: int,
+    history_mode: str = "compact",
+    drafting_mode: str = "iterative",
+    num_drafts: int = 3,
+    revision_mode: str = "edits",
+    context_mode: str = "retrieval",
+    model_tiers: str = "tiered"
 ) -> tuple[str, Dict, bool]:
     """
     Run the extraction pipeline and return output logs + state as a dict.
@@ -922,21 +2909,63 @@ def extract_information(
         job_description_content = read_file_content(job_description_file)
         motivation_content = read_file_content(motivation_file) if motivation_file else ""
         examples_content = read_file_content(examples_file) if examples_file else ""
-        output_text += "Successfully extracted input."      
+        output_text += "Successfully extracted input."
+        cache_stats = docling_cache_stats()
+        if cache_stats["hits"] or cache_stats["misses"]:
+            output_text += f"\nPDF extraction cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses."      
     except Exception as e:
         output_text += f"Reading input files failed: {str(e)}"
         return output_text, None, False
     
     state = ApplicationAgentState.model_validate(state_dict)
+    if not state.session_id:
+        state.session_id = uuid.uuid4().hex
     state.cv = cv_content
     state.job_description = job_description_content
     state.motivation = motivation_content
     state.examples = examples_content 
+    # assessments of previous inputs are outdated
+    state.artifacts = current_artifacts(state)
+    state.max_iterations = int(max_iterations)
+    state.history_mode = history_mode
+    state.drafting_mode = drafting_mode
+    state.num_drafts = int(num_drafts)
+    state.revision_mode = revision_mode
+    state.context_mode = context_mode
+    state.model_tiers = model_tiers
+    retrieval_report = index_session_documents(state)
+    if retrieval_report:
+        output_text += f"\n{retrieval_report}."
     
     state_dict = type_conversion(state, ApplicationAgentState)
     
     return output_text, state_dict, True
 
+# %%
+async def aextract_information(
+    state_dict,
+    cv_file,
+    job_description_file,
+    motivation_file,
+    examples_file,
+    max_iterations: int,
+    history_mode: str = "compact",
+    drafting_mode: str = "iterative",
+    num_drafts: int = 3,
+    revision_mode: str = "edits",
+    context_mode: str = "retrieval",
+    model_tiers: str = "tiered"
+) -> tuple[str, Dict, bool]:
+    """
+    Async variant of extract_information, the document conversion runs in a worker thread.
+    """
+    return await asyncio.to_thread(
+        extract_information, state_dict, cv_file, job_description_file, motivation_file, examples_file, max_iterations, history_mode, drafting_mode, num_drafts, revision_mode, context_mode, model_tiers
+    )
+
+# %% [markdown]
+# ### Gradio function - Call orchestrator
+
 # %%
 def call_orchestrator(state_dict : Dict, user_query : str):
     "Function prototype to call the orchestrator agent"
@@ -944,13 +2973,15 @@ def call_orchestrator(state_dict : Dict, user_query : str):
 
     state.user_query = user_query
     # Capture print outputs
-    buffer = StringIO()
-    with contextlib.redirect_stdout(buffer):
-        # if TRACING:
-        #     result = graph.invoke(input=state, config={"callbacks": [langfuse_handler]})
-        # else:
-           # result = graph.invoke(input=state)
-        result = graph.invoke(input=state)
+    context, buffer = session_log_context()
+    # if TRACING:
+    #     result = graph.invoke(input=state, config={"callbacks": [langfuse_handler]})
+    # else:
+       # result = graph.invoke(input=state)
+    graph_input, config = context.run(start_checkpointed_run, state)
+    result = context.run(graph.invoke, input=graph_input, config=config)
+    finish_checkpointed_run(config)
+    buffer.write(runtime_stats_report())
 
     result_dict = type_conversion(result, ApplicationAgentState)
 
@@ -958,6 +2989,828 @@ def call_orchestrator(state_dict : Dict, user_query : str):
 
     return output_text, result_dict, True
 
+async def arun_graph(state : ApplicationAgentState) -> Tuple[Dict, StringIO]:
+    "Run the graph with ainvoke in its own log context, returns the result and the log buffer"
+    # Capture print outputs
+    context, buffer = session_log_context()
+    graph_input, config = await asyncio.to_thread(context.copy().run, start_checkpointed_run, state)
+    result = await asyncio.create_task(graph.ainvoke(input=graph_input, config=config), context=context)
+    await asyncio.to_thread(finish_checkpointed_run, config)
+    return result, buffer
+
+async def acall_orchestrator(state_dict : Dict, user_query : str):
+    "Async variant of call_orchestrator running the graph with ainvoke"
+    state = ApplicationAgentState.model_validate(state_dict)
+
+    state.user_query = user_query
+    result, buffer = await arun_graph(state)
+    buffer.write(runtime_stats_report())
+
+    result_dict = type_conversion(result, ApplicationAgentState)
+
+    return buffer.getvalue(), result_dict, True
+
+# %%
+STREAM_UPDATE_INTERVAL = float(os.environ.get("STREAM_UPDATE_INTERVAL", 0.05))
+
+class AnswerStream:
+    "Collects the streamed tokens of the final answer (and optionally the writer's drafts) and measures the time to first token"
+
+    def __init__(self, stream_drafts : bool = False):
+        self.streamed_nodes = ["final_answer_tool", "writer_agent"] if stream_drafts else ["final_answer_tool"]
+        # texts of the messages streamed in the current step, the best-of-n drafts stream in parallel
+        self.texts : Dict[str, str] = {}
+        self.step = None
+        self.start = time.perf_counter()
+        self.first_token, self.first_answer_token, self.last_update = None, None, 0.0
+
+    def add(self, message : Any, metadata : Dict) -> Optional[str]:
+        "Add a streamed message chunk, returns the Markdown to display if the UI should be updated"
+        node = metadata.get("langgraph_node")
+        if node not in self.streamed_nodes or not isinstance(message.content, str) or not message.content:
+            return None
+
+        # every graph step starts a new answer or a new set of drafts
+        step = (node, metadata.get("langgraph_step"))
+        if step != self.step:
+            self.step, self.texts = step, {}
+        self.texts[message.id] = self.texts.get(message.id, "") + message.content
+
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now - self.start
+        if self.first_answer_token is None and node == "final_answer_tool":
+            self.first_answer_token = now - self.start
+
+        if now - self.last_update < STREAM_UPDATE_INTERVAL:
+            return None
+        self.last_update = now
+        title = "### ✏️ Draft of the writer agent\n" if node == "writer_agent" else ""
+        if len(self.texts) > 1:
+            return title + "\n\n---\n".join(f"**Draft {i}**\n\n{hide_think_blocks(text)}" for i, text in enumerate(self.texts.values(), 1))
+        return title + hide_think_blocks(next(iter(self.texts.values())))
+
+    def report(self) -> str:
+        "Return the timings of the stream for the logs"
+        report = f"\n⏱️ Total time: {time.perf_counter() - self.start:.2f}s\n"
+        if self.first_token is not None:
+            report += f"⏱️ Time to first token: {self.first_token:.2f}s\n"
+        if self.first_answer_token is not None:
+            report += f"⏱️ Time to first token of the final answer: {self.first_answer_token:.2f}s\n"
+        return report
+
+def stream_orchestrator(state_dict : Dict, user_query : str, stream_drafts : bool = False):
+    "Call the orchestrator agent and stream the final answer (and optionally the writer's drafts) token by token"
+    state = ApplicationAgentState.model_validate(state_dict)
+    state.user_query = user_query
+
+    # Capture print outputs
+    context, buffer = session_log_context()
+    answer_stream = AnswerStream(stream_drafts)
+    result = state
+
+    graph_input, config = context.run(start_checkpointed_run, state)
+    chunks = graph.stream(input=graph_input, config=config, stream_mode=["messages", "values"])
+    while True:
+        try:
+            mode, chunk = context.run(next, chunks)
+        except StopIteration:
+            break
+
+        if mode == "values":
+            result = chunk
+            continue
+
+        answer = answer_stream.add(*chunk)
+        if answer is not None:
+            yield buffer.getvalue(), gr.skip(), False, answer
+
+    finish_checkpointed_run(config)
+    buffer.write(answer_stream.report())
+    buffer.write(runtime_stats_report())
+    result_dict = type_conversion(result, ApplicationAgentState)
+
+    yield buffer.getvalue(), result_dict, True, ""
+
+async def astream_orchestrator(state_dict : Dict, user_query : str, stream_drafts : bool = False):
+    "Async variant of stream_orchestrator running the graph with astream"
+    state = ApplicationAgentState.model_validate(state_dict)
+    state.user_query = user_query
+
+    # Capture print outputs
+    context, buffer = session_log_context()
+    answer_stream = AnswerStream(stream_drafts)
+    result = state
+
+    # the graph runs in its own task, so that its prints end up in the log buffer of this session
+    graph_input, config = await asyncio.to_thread(context.copy().run, start_checkpointed_run, state)
+    chunks = asyncio.Queue()
+    async def produce_chunks():
+        try:
+            async for chunk in graph.astream(input=graph_input, config=config, stream_mode=["messages", "values"]):
+                await chunks.put(chunk)
+        finally:
+            await chunks.put(None)
+
+    producer = asyncio.create_task(produce_chunks(), context=context)
+    try:
+        while (item := await chunks.get()) is not None:
+            mode, chunk = item
+            if mode == "values":
+                result = chunk
+                continue
+
+            answer = answer_stream.add(*chunk)
+            if answer is not None:
+                yield buffer.getvalue(), gr.skip(), False, answer
+
+        # raise errors of the graph execution
+        await producer
+    finally:
+        producer.cancel()
+
+    await asyncio.to_thread(finish_checkpointed_run, config)
+    buffer.write(answer_stream.report())
+    buffer.write(runtime_stats_report())
+    result_dict = type_conversion(result, ApplicationAgentState)
+
+    yield buffer.getvalue(), result_dict, True, ""
+
+# %% [markdown]
+# ### Gradio function - Job API
+# - Headless and MCP clients submit a job, receive a job id and poll its status and result instead of holding a connection open for the whole run
+# - Jobs are executed by a bounded number of workers in their own event loop, so they don't take slots of the Gradio queue used by browser sessions
+# - Queued jobs are taken round-robin per client, a client submitting many jobs only delays its own jobs
+# - Endpoints: `submit_job`, `job_status`, `job_result` and `stream_job_status`
+
+# %%
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 200))
+JOB_MAX_QUEUED_PER_CLIENT = int(os.environ.get("JOB_MAX_QUEUED_PER_CLIENT", 20))
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", 3600))
+JOB_POLL_INTERVAL = 1.0
+
+class JobQueueFullError(Exception):
+    "Raised if the job queue or the share of a client is full"
+
+async def run_job_request(job_id : str, request : Dict[str, Any]) -> Tuple[Dict, str]:
+    "Run the graph for the inputs of a job, returns the result and the logs"
+    state = ApplicationAgentState(session_id=f"job:{job_id}", **request)
+    index_session_documents(state)
+    result, buffer = await arun_graph(state)
+    return result, buffer.getvalue()
+
+class JobQueue:
+    "Bounded job queue with per-client round-robin scheduling, executed by worker tasks in a dedicated event loop"
+
+    def __init__(self, workers : int, max_queued : int, max_queued_per_client : int, result_ttl : float):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self.result_ttl = result_ttl
+        self._jobs : Dict[str, Dict[str, Any]] = {}
+        # queued job ids per client, the order of the clients is the rotation
+        self._pending : OrderedDict[str, deque] = OrderedDict()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+
+    def _start(self):
+        "Start the event loop and the workers on the first submission"
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        def run():
+            asyncio.set_event_loop(loop)
+            self._wakeup = asyncio.Semaphore(0)
+            for _ in range(self.workers):
+                loop.create_task(self._worker())
+            started.set()
+            loop.run_forever()
+        threading.Thread(target=run, name="job-workers", daemon=True).start()
+        started.wait()
+        self._loop = loop
+
+    def submit(self, client : str, request : Dict[str, Any]) -> Dict[str, Any]:
+        "Queue a job and return its status"
+        with self._lock:
+            self._prune()
+            queued = sum(len(job_ids) for job_ids in self._pending.values())
+            if queued >= self.max_queued:
+                raise JobQueueFullError(f"The job queue is full ({queued} jobs), please retry later.")
+            if len(self._pending.get(client, ())) >= self.max_queued_per_client:
+                raise JobQueueFullError(f"Client {client} already has {self.max_queued_per_client} queued jobs, please wait for them to finish.")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {"job_id": job_id, "client": client, "status": "queued", "submitted": time.time(), "request": request}
+            self._pending.setdefault(client, deque()).append(job_id)
+            if self._loop is None:
+                self._start()
+        metrics.inc("jobs_submitted_total")
+        metrics.set("jobs_queued", queued + 1)
+        self._loop.call_soon_threadsafe(self._wakeup.release)
+        return self.status(job_id)
+
+    def _next_job(self) -> Dict[str, Any]:
+        "Take the oldest job of the next client in the rotation"
+        with self._lock:
+            client, job_ids = next(iter(self._pending.items()))
+            job = self._jobs[job_ids.popleft()]
+            del self._pending[client]
+            if job_ids:
+                # the client moves to the end of the rotation
+                self._pending[client] = job_ids
+            job.update(status="running", started=time.time())
+            metrics.set("jobs_queued", sum(len(job_ids) for job_ids in self._pending.values()))
+            return job
+
+    async def _worker(self):
+        while True:
+            await self._wakeup.acquire()
+            job = self._next_job()
+            metrics.observe("job_queue_wait_seconds", job["started"] - job["submitted"])
+            try:
+                result, logs = await run_job_request(job["job_id"], job.pop("request"))
+                job.update(status="done", logs=logs, result={
+                    "final_answer": result.get("final_answer", ""),
+                    "cover_letter": result.get("cover_letter", ""),
+                    "feedback": result.get("feedback", ""),
+                })
+            except Exception as e:
+                job.update(status="failed", error=f"{type(e).__name__}: {e}")
+            job["finished"] = time.time()
+            metrics.inc("jobs_total", status=job["status"])
+            metrics.observe("job_duration_seconds", job["finished"] - job["started"])
+
+    def _position(self, job : Dict[str, Any]) -> int:
+        "Number of queued jobs that are executed before the job"
+        clients = list(self._pending)
+        index = self._pending[job["client"]].index(job["job_id"])
+        # every round of the rotation takes one job per client
+        ahead = sum(min(len(job_ids), index) for job_ids in self._pending.values())
+        return ahead + sum(1 for client in clients[:clients.index(job["client"])] if len(self._pending[client]) > index)
+
+    def status(self, job_id : str, include_result : bool = False) -> Dict[str, Any]:
+        "Status of a job, optionally with its result and logs"
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise KeyError(f"Unknown job id {job_id}, results are kept for {self.result_ttl:.0f}s.")
+            status = {"job_id": job_id, "status": job["status"], "submitted": job["submitted"]}
+            if job["status"] == "queued":
+                status["position"] = self._position(job)
+            if "started" in job:
+                status["queue_seconds"] = round(job["started"] - job["submitted"], 3)
+                status["run_seconds"] = round(job.get("finished", time.time()) - job["started"], 3)
+            if include_result:
+                status.update({key: job[key] for key in ("result", "error", "logs") if key in job})
+            elif "error" in job:
+                status["error"] = job["error"]
+            return status
+
+    def _prune(self):
+        "Forget finished jobs after the TTL"
+        expired = [job_id for job_id, job in self._jobs.items() if time.time() - job.get("finished", time.time()) > self.result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+job_queue = JobQueue(JOB_WORKERS, JOB_QUEUE_SIZE, JOB_MAX_QUEUED_PER_CLIENT, JOB_RESULT_TTL)
+
+def submit_job(
+    cv : str,
+    job_description : str,
+    query : str = "Generate a cover letter",
+    motivation : str = "",
+    examples : str = "",
+    max_iterations : int = 2,
+    client_id : str = "",
+    history_mode : str = "compact",
+    context_mode : str = "retrieval",
+    drafting_mode : str = "iterative",
+    num_drafts : int = 3,
+    revision_mode : str = "edits",
+    model_tiers : str = "tiered",
+    request : gr.Request = None
+) -> Dict:
+    """
+    Submit a request to the application assistant and return the job id, poll job_status and fetch the answer with job_result.
+
+    Args:
+        cv: CV of the applicant as text or Markdown.
+        job_description: Job description as text.
+        query: Task for the application assistant, e. g. "Generate a cover letter".
+        motivation: Optional motivation of the applicant.
+        examples: Optional previous cover letters of the applicant.
+        max_iterations: Maximum number of writer/critic iterations.
+        client_id: Optional client name used for fair scheduling, defaults to the IP address.
+        history_mode: "compact" or "full" message history passed to the agents.
+        context_mode: "retrieval" passes the sections of the CV and examples most relevant to the job description, "full" the complete documents.
+        drafting_mode: "iterative" revises one draft with the critic, "best_of_n" writes several drafts in parallel and the critic selects the best one.
+        num_drafts: Number of parallel drafts in the best_of_n drafting mode.
+        revision_mode: "edits" only regenerates the paragraphs addressed by the critic, "rewrite" the whole cover letter.
+        model_tiers: "tiered" uses the model of each agent's tier, "strong" or "fast" the same model for all agents.
+    """
+    client = client_id or (request.client.host if request is not None and request.client else "anonymous")
+    inputs = {
+        "cv": cv, "job_description": job_description, "user_query": query,
+        "motivation": motivation, "examples": examples, "max_iterations": int(max_iterations),
+        "history_mode": history_mode, "context_mode": context_mode, "drafting_mode": drafting_mode,
+        "num_drafts": int(num_drafts), "revision_mode": revision_mode, "model_tiers": model_tiers
+    }
+    # invalid options are rejected on submission instead of failing the job later
+    if not 2 <= inputs["num_drafts"] <= len(DRAFT_EMPHASES):
+        raise gr.Error(f"num_drafts has to be between 2 and {len(DRAFT_EMPHASES)}")
+    try:
+        ApplicationAgentState.model_validate(inputs)
+    except ValidationError as e:
+        raise gr.Error(str(e))
+    try:
+        return job_queue.submit(client, inputs)
+    except JobQueueFullError as e:
+        raise gr.Error(str(e))
+
+def job_status(job_id : str) -> Dict:
+    """
+    Return the status of a job (queued, running, done or failed) and its position in the queue.
+
+    Args:
+        job_id: Id returned by submit_job.
+    """
+    try:
+        return job_queue.status(job_id)
+    except KeyError as e:
+        raise gr.Error(str(e.args[0]))
+
+def job_result(job_id : str) -> Dict:
+    """
+    Return the status of a job with the final answer, the cover letter and the logs once it is done.
+
+    Args:
+        job_id: Id returned by submit_job.
+    """
+    try:
+        return job_queue.status(job_id, include_result=True)
+    except KeyError as e:
+        raise gr.Error(str(e.args[0]))
+
+async def stream_job_status(job_id : str):
+    """
+    Stream the status of a job until it is done or failed, the last update contains the result.
+
+    Args:
+        job_id: Id returned by submit_job.
+    """
+    while (status := job_status(job_id))["status"] in ("queued", "running"):
+        yield status
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+    yield job_result(job_id)
+
+# %% [markdown]
+# ### Worker processes
+# - With `WORKER_MODE=processes` the Gradio front-end only enqueues tasks in a shared SQLite store and renders their progress, worker processes (`worker.py`) execute the extraction and the graph runs
+# - Workers claim tasks with a lease and renew it while they run, a task of a crashed worker is claimed again after the lease expired and resumes from the checkpoint of its last completed step
+# - Tasks of the browser sessions are claimed before the jobs of the job API, clients with fewer running tasks go first
+
+# %%
+WORKER_MODE = os.environ.get("WORKER_MODE", "inprocess").lower()
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", 2))
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", 8))
+TASK_STORE_PATH = Path(os.environ.get("TASK_STORE_PATH", ".cache/tasks.sqlite"))
+TASK_LEASE_SECONDS = float(os.environ.get("TASK_LEASE_SECONDS", 60))
+TASK_MAX_ATTEMPTS = int(os.environ.get("TASK_MAX_ATTEMPTS", 3))
+TASK_POLL_INTERVAL = 0.2
+TASK_PROGRESS_INTERVAL = 0.5
+SESSION_TASK_PRIORITY, JOB_TASK_PRIORITY = 0, 1
+
+class TaskStore:
+    "Tasks shared by the front-end and the worker processes in a SQLite database, claimed with a lease"
+
+    def __init__(self, path : Path, lease_seconds : float, max_attempts : int):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _db(self) -> sqlite3.Connection:
+        "Open the database on first use, transactions are explicit to lock the database while a task is claimed"
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS tasks (task_id TEXT PRIMARY KEY, kind TEXT NOT NULL, client TEXT NOT NULL, priority INTEGER NOT NULL, "
+                "status TEXT NOT NULL, payload TEXT NOT NULL, progress TEXT, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "worker TEXT, lease_until REAL, submitted REAL NOT NULL, started REAL, finished REAL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, priority, submitted)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS workers (worker TEXT PRIMARY KEY, pid INTEGER NOT NULL, started REAL NOT NULL, heartbeat REAL NOT NULL)")
+        return self._connection
+
+    def submit(self, kind : str, payload : Any, client : str, priority : int = SESSION_TASK_PRIORITY) -> str:
+        "Queue a task and return its id"
+        task_id = uuid.uuid4().hex
+        with self._lock:
+            self._db().execute(
+                "INSERT INTO tasks (task_id, kind, client, priority, status, payload, submitted) VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (task_id, kind, client, priority, json.dumps(payload), time.time())
+            )
+        metrics.inc("tasks_submitted_total", kind=kind)
+        return task_id
+
+    def claim(self, worker : str) -> Optional[Dict[str, Any]]:
+        "Claim the next queued task or a task whose lease expired, returns None if there is nothing to do"
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = db.execute(
+                        "SELECT task_id, kind, payload, attempts, status FROM tasks t WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                        "ORDER BY priority, (SELECT COUNT(*) FROM tasks r WHERE r.client = t.client AND r.status = 'running' AND r.lease_until >= ?), submitted LIMIT 1",
+                        (now, now)
+                    ).fetchone()
+                    if row is None:
+                        return None
+                    task_id, kind, payload, attempts, status = row
+                    if status == "running" and attempts >= self.max_attempts:
+                        db.execute(
+                            "UPDATE tasks SET status = 'failed', error = ?, finished = ? WHERE task_id = ?",
+                            (f"The task was interrupted {attempts} times, e. g. by crashed workers.", now, task_id)
+                        )
+                        continue
+                    db.execute(
+                        "UPDATE tasks SET status = 'running', worker = ?, attempts = attempts + 1, started = COALESCE(started, ?), lease_until = ? WHERE task_id = ?",
+                        (worker, now, now + self.lease_seconds, task_id)
+                    )
+                    if status == "running":
+                        metrics.inc("tasks_reclaimed_total", kind=kind)
+                    return {"task_id": task_id, "kind": kind, "payload": json.loads(payload), "attempt": attempts + 1}
+            finally:
+                db.execute("COMMIT")
+
+    def renew(self, worker : str):
+        "Extend the leases of the running tasks of a worker and record its heartbeat"
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("UPDATE tasks SET lease_until = ? WHERE worker = ? AND status = 'running'", (now + self.lease_seconds, worker))
+            db.execute("INSERT OR REPLACE INTO workers (worker, pid, started, heartbeat) VALUES (?, ?, COALESCE((SELECT started FROM workers WHERE worker = ?), ?), ?)", (worker, os.getpid(), worker, now, now))
+
+    def report(self, task : Dict[str, Any], progress : Any):
+        "Store the intermediate output of a running task"
+        with self._lock:
+            self._db().execute("UPDATE tasks SET progress = ? WHERE task_id = ? AND attempts = ?", (json.dumps(progress), task["task_id"], task["attempt"]))
+
+    def finish(self, task : Dict[str, Any], result : Any = None, error : Optional[str] = None):
+        "Store the result or the error of a task, ignored if the task was claimed again by another worker in the meantime"
+        with self._lock:
+            self._db().execute(
+                "UPDATE tasks SET status = ?, result = ?, error = ?, finished = ? WHERE task_id = ? AND attempts = ? AND status = 'running'",
+                ("failed" if error else "done", json.dumps(result), error, time.time(), task["task_id"], task["attempt"])
+            )
+
+    def cancel(self, task_id : str):
+        "Drop a task that is still queued, running tasks complete"
+        with self._lock:
+            self._db().execute("UPDATE tasks SET status = 'cancelled', finished = ? WHERE task_id = ? AND status = 'queued'", (time.time(), task_id))
+
+    def get(self, task_id : str) -> Optional[Dict[str, Any]]:
+        "Return a task with its decoded payload, progress and result, the position of queued tasks and None for unknown ids"
+        with self._lock:
+            db = self._db()
+            db.row_factory = sqlite3.Row
+            try:
+                row = db.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+                if row is None:
+                    return None
+                task = dict(row)
+                if task["status"] == "queued":
+                    task["position"] = db.execute(
+                        "SELECT COUNT(*) FROM tasks WHERE status = 'queued' AND (priority < ? OR (priority = ? AND submitted < ?))",
+                        (task["priority"], task["priority"], task["submitted"])
+                    ).fetchone()[0]
+            finally:
+                db.row_factory = None
+        for key in ("payload", "progress", "result"):
+            task[key] = json.loads(task[key]) if task[key] is not None else None
+        return task
+
+    def queued(self, client : Optional[str] = None) -> int:
+        "Number of queued tasks, optionally of one client"
+        with self._lock:
+            if client is None:
+                return self._db().execute("SELECT COUNT(*) FROM tasks WHERE status = 'queued'").fetchone()[0]
+            return self._db().execute("SELECT COUNT(*) FROM tasks WHERE status = 'queued' AND client = ?", (client,)).fetchone()[0]
+
+    def prune(self, ttl : float):
+        "Forget finished tasks after the TTL and workers without heartbeat"
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM tasks WHERE status IN ('done', 'failed', 'cancelled') AND finished < ?", (now - ttl,))
+            db.execute("DELETE FROM workers WHERE heartbeat < ?", (now - 3 * self.lease_seconds,))
+
+    def live_workers(self) -> int:
+        "Number of worker processes with a recent heartbeat"
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM workers WHERE heartbeat >= ?", (time.time() - self.lease_seconds,)).fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        "Number of tasks per status and of live workers"
+        with self._lock:
+            counts = dict(self._db().execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+        return {**counts, "workers": self.live_workers()}
+
+task_store = TaskStore(TASK_STORE_PATH, TASK_LEASE_SECONDS, TASK_MAX_ATTEMPTS)
+
+# %% [markdown]
+# #### Task handlers of the workers
+
+# %%
+async def extract_information_task(payload : Dict, report : Callable) -> Any:
+    return await aextract_information(*payload["args"])
+
+async def call_orchestrator_task(payload : Dict, report : Callable) -> Any:
+    return await acall_orchestrator(payload["state_dict"], payload["user_query"])
+
+async def stream_orchestrator_task(payload : Dict, report : Callable) -> Any:
+    "Run the streaming handler, the logs and the streamed answer are reported as progress"
+    async for logs, result_dict, completed, answer in astream_orchestrator(payload["state_dict"], payload["user_query"], payload["stream_drafts"]):
+        if completed:
+            return logs, result_dict, completed, answer
+        await report({"logs": logs, "answer": answer})
+
+async def job_task(payload : Dict, report : Callable) -> Any:
+    result, logs = await run_job_request(payload["job_id"], payload["request"])
+    return {
+        "result": {key: result.get(key, "") for key in ("final_answer", "cover_letter", "feedback")},
+        "logs": logs
+    }
+
+TASK_HANDLERS = {
+    "extract_information": extract_information_task,
+    "call_orchestrator": call_orchestrator_task,
+    "stream_orchestrator": stream_orchestrator_task,
+    "job": job_task,
+}
+
+async def execute_task(task : Dict[str, Any]):
+    "Execute a claimed task and store its result, progress reports are throttled"
+    last_report = 0.0
+    async def report(progress : Any):
+        nonlocal last_report
+        if time.perf_counter() - last_report >= TASK_PROGRESS_INTERVAL:
+            last_report = time.perf_counter()
+            await asyncio.to_thread(task_store.report, task, progress)
+
+    start = time.perf_counter()
+    try:
+        result = await TASK_HANDLERS[task["kind"]](task["payload"], report)
+        await asyncio.to_thread(task_store.finish, task, result=result)
+        status = "done"
+    except Exception as e:
+        await asyncio.to_thread(task_store.finish, task, error=f"{type(e).__name__}: {e}")
+        status = "failed"
+    metrics.inc("tasks_total", kind=task["kind"], status=status)
+    metrics.observe("task_duration_seconds", time.perf_counter() - start, kind=task["kind"])
+
+async def arun_task_worker(worker : str, concurrency : int = WORKER_CONCURRENCY):
+    "Claim and execute tasks of the shared store forever, up to `concurrency` tasks at the same time"
+    slots = asyncio.Semaphore(concurrency)
+    running = set()
+
+    async def renew_leases():
+        while True:
+            await asyncio.to_thread(task_store.renew, worker)
+            await asyncio.to_thread(task_store.prune, JOB_RESULT_TTL)
+            await asyncio.sleep(task_store.lease_seconds / 3)
+
+    renewer = asyncio.create_task(renew_leases())
+    try:
+        while True:
+            await slots.acquire()
+            task = await asyncio.to_thread(task_store.claim, worker)
+            if task is None:
+                slots.release()
+                await asyncio.sleep(TASK_POLL_INTERVAL)
+                continue
+            if task["attempt"] > 1:
+                print(f"♻️ Worker {worker} claimed task {task['task_id']} ({task['kind']}) again, attempt {task['attempt']}")
+            execution = asyncio.create_task(execute_task(task))
+            running.add(execution)
+            execution.add_done_callback(running.discard)
+            execution.add_done_callback(lambda _: slots.release())
+    finally:
+        renewer.cancel()
+
+# %% [markdown]
+# #### Front-end handlers
+
+# %%
+async def await_task(task_id : str):
+    "Poll a task until it finished, yields the task whenever its status or progress changed"
+    last = None
+    finished = False
+    try:
+        while True:
+            task = await asyncio.to_thread(task_store.get, task_id)
+            if task["status"] not in ("queued", "running"):
+                finished = True
+                yield task
+                return
+            if (task["status"], task.get("position"), task["progress"]) != last:
+                last = (task["status"], task.get("position"), task["progress"])
+                yield task
+            await asyncio.sleep(TASK_POLL_INTERVAL)
+    finally:
+        if not finished:
+            # the session is gone, nobody fetches the result
+            await asyncio.to_thread(task_store.cancel, task_id)
+
+def task_result(task : Dict[str, Any]) -> Any:
+    "Result of a finished task, failed tasks are shown as Gradio errors"
+    if task["status"] != "done":
+        raise gr.Error(task["error"] or f"The task was {task['status']}.")
+    return task["result"]
+
+def waiting_message(task : Dict[str, Any]) -> str:
+    return f"⏳ Waiting for a worker, {task['position']} tasks ahead." if task["status"] == "queued" else "⏳ Generating response..."
+
+async def remote_extract_information(state_dict, *args) -> tuple[str, Dict, bool]:
+    "extract_information executed by a worker process"
+    task_id = await asyncio.to_thread(task_store.submit, "extract_information", {"args": [state_dict, *args]}, (state_dict or {}).get("session_id") or "anonymous")
+    async for task in await_task(task_id):
+        pass
+    return tuple(task_result(task))
+
+async def remote_call_orchestrator(state_dict : Dict, user_query : str):
+    "call_orchestrator executed by a worker process"
+    task_id = await asyncio.to_thread(task_store.submit, "call_orchestrator", {"state_dict": state_dict, "user_query": user_query}, state_dict.get("session_id") or "anonymous")
+    async for task in await_task(task_id):
+        pass
+    return tuple(task_result(task))
+
+async def remote_stream_orchestrator(state_dict : Dict, user_query : str, stream_drafts : bool = False):
+    "stream_orchestrator executed by a worker process, the logs and the answer are updated with the reported progress"
+    payload = {"state_dict": state_dict, "user_query": user_query, "stream_drafts": stream_drafts}
+    task_id = await asyncio.to_thread(task_store.submit, "stream_orchestrator", payload, state_dict.get("session_id") or "anonymous")
+    async for task in await_task(task_id):
+        if task["status"] in ("queued", "running") and task["progress"] is None:
+            yield gr.skip(), gr.skip(), False, waiting_message(task)
+        elif task["status"] in ("queued", "running"):
+            yield task["progress"]["logs"], gr.skip(), False, task["progress"]["answer"]
+        else:
+            yield tuple(task_result(task))
+
+class SharedJobQueue:
+    "Job queue of the multi-process deployment, the jobs are tasks of the shared store executed by the workers"
+
+    def __init__(self, store : TaskStore, max_queued : int, max_queued_per_client : int, result_ttl : float):
+        self.store = store
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self.result_ttl = result_ttl
+
+    def submit(self, client : str, request : Dict[str, Any]) -> Dict[str, Any]:
+        "Queue a job and return its status"
+        self.store.prune(self.result_ttl)
+        queued = self.store.queued()
+        if queued >= self.max_queued:
+            raise JobQueueFullError(f"The job queue is full ({queued} jobs), please retry later.")
+        if self.store.queued(client) >= self.max_queued_per_client:
+            raise JobQueueFullError(f"Client {client} already has {self.max_queued_per_client} queued jobs, please wait for them to finish.")
+        # the graph run is checkpointed under the id in the payload, so a job claimed again after a crash resumes
+        job_id = self.store.submit("job", {"job_id": uuid.uuid4().hex, "request": request}, client, priority=JOB_TASK_PRIORITY)
+        metrics.inc("jobs_submitted_total")
+        return self.status(job_id)
+
+    def status(self, job_id : str, include_result : bool = False) -> Dict[str, Any]:
+        "Status of a job, optionally with its result and logs"
+        task = self.store.get(job_id)
+        if task is None or task["kind"] != "job":
+            raise KeyError(f"Unknown job id {job_id}, results are kept for {self.result_ttl:.0f}s.")
+        status = {"job_id": job_id, "status": task["status"], "submitted": task["submitted"]}
+        if task["status"] == "queued":
+            status["position"] = task["position"]
+        if task["started"] is not None:
+            status["queue_seconds"] = round(task["started"] - task["submitted"], 3)
+            status["run_seconds"] = round((task["finished"] or time.time()) - task["started"], 3)
+        if task["error"]:
+            status["error"] = task["error"]
+        if include_result and task["result"]:
+            status.update(task["result"])
+        return status
+
+if WORKER_MODE == "processes":
+    # the jobs of the job API are executed by the worker processes as well
+    job_queue = SharedJobQueue(task_store, JOB_QUEUE_SIZE, JOB_MAX_QUEUED_PER_CLIENT, JOB_RESULT_TTL)
+
+def start_worker_processes(workers : int) -> subprocess.Popen:
+    "Start worker.py with the given number of worker processes, they are stopped with the front-end"
+    supervisor = subprocess.Popen([sys.executable, str(Path(__file__).with_name("worker.py")), "--workers", str(workers)])
+    atexit.register(supervisor.terminate)
+    print(f"Started {workers} worker processes (pid {supervisor.pid})")
+    return supervisor
+
+# %% [markdown]
+# ### Warm-up and readiness
+# - After launch, a background thread loads the docling models and opens a connection of the LLM client pool, so the first user doesn't pay the warm-up
+# - `/ready` on the metrics server returns 503 until the warm-up finished, e. g. for the readiness probe of a container
+
+# %%
+WARMUP = os.environ.get("WARMUP", "on").lower() != "off"
+
+_ready = threading.Event()
+_warmup_stats : Dict[str, float] = {}
+
+def warm_up():
+    "Load the docling converter and the LLM client of the configured provider, failures only delay the first request"
+    start = time.perf_counter()
+    try:
+        if DOCLING_WORKERS > 0:
+            warm_up_docling_pool()
+        else:
+            from docling.datamodel.base_models import InputFormat
+            get_document_converter().initialize_pipeline(InputFormat.PDF)
+        _warmup_stats["docling_seconds"] = time.perf_counter() - start
+    except Exception as e:
+        print(f"Warm-up of docling failed: {e}")
+
+    start = time.perf_counter()
+    try:
+        if LLM_MODE != "replay" and API_KEY:
+            for provider, model_name in set(MODEL_TIERS.values()):
+                get_llm_chain(target=(provider, model_name))
+                if provider == "nebius":
+                    # a cheap request opens a keep-alive connection (TLS handshake included) in the pool
+                    with _llm_pool_lock:
+                        chat_model = _get_chat_model(provider, model_name)
+                    chat_model.root_client.models.list()
+        _warmup_stats["llm_client_seconds"] = time.perf_counter() - start
+    except Exception as e:
+        print(f"Warm-up of the LLM client failed: {e}")
+
+    _ready.set()
+    print(f"Warm-up finished: {', '.join(f'{name} {seconds:.2f}s' for name, seconds in _warmup_stats.items())}")
+
+def start_warm_up() -> threading.Thread:
+    "Run the warm-up in a daemon thread, the readiness flips once it is done"
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def readiness() -> Dict[str, Any]:
+    "Readiness of the app for the readiness probe"
+    status = {"ready": _ready.is_set(), **_warmup_stats}
+    if WORKER_MODE == "processes":
+        status["workers"] = task_store.live_workers()
+        status["ready"] = status["ready"] and status["workers"] > 0
+    return status
+
+# %% [markdown]
+# ### Metrics server
+# - Small HTTP server next to the Gradio app serving `/metrics` (Prometheus), `/metrics.json` and the readiness probe `/ready`
+# - Opt-in with `METRICS_PORT`, it only listens on localhost unless `METRICS_HOST` is set, e. g. to `0.0.0.0` in a container
+
+# %%
+METRICS_PORT = os.environ.get("METRICS_PORT", "off")
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    "Serve the metrics in the Prometheus text format and as JSON summary"
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            self.respond(200, metrics.prometheus(), "text/plain; version=0.0.4")
+        elif path == "/metrics.json":
+            self.respond(200, json.dumps(metrics.summary()), "application/json")
+        elif path == "/ready":
+            status = readiness()
+            self.respond(200 if status["ready"] else 503, json.dumps(status), "application/json")
+        else:
+            self.respond(404, "Not found", "text/plain")
+
+    def respond(self, status : int, body : str, content_type : str):
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # scrapes are too frequent for the console
+        pass
+
+def start_metrics_server(port : int, host : str = METRICS_HOST) -> ThreadingHTTPServer:
+    "Start the metrics server in a daemon thread"
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
 # %% [markdown]
 # ## Gradio Interface
 
@@ -973,7 +3826,7 @@ with gr.Blocks() as application_agent_server:
             gr.Markdown("## Your happy AI assistant 🦛🤗 helps you to land your next dream job.")
             gr.Markdown("Just provide some information about yourself and the oppurtunity and ask the assistant for help.")
 
-    state_dict = gr.State(value=ApplicationAgentState(available_agents=available_agents).model_dump())
+    state_dict = gr.State(value={})
     extraction_successful = gr.State(value=False)
     
     with gr.Tabs():
@@ -991,6 +3844,13 @@ with gr.Blocks() as application_agent_server:
             
             with gr.Accordion("Advanced options", open=False):
                 max_iterations = gr.Number(label="Number of refinement iterations", value=2, precision=0)
+                with gr.Row():
+                    drafting_mode = gr.Radio(["iterative", "best_of_n"], value="iterative", label="Drafting mode", info="best_of_n writes several drafts in parallel and the critic selects the best one")
+                    num_drafts = gr.Number(label="Number of parallel drafts (best_of_n)", value=3, precision=0, minimum=2, maximum=len(DRAFT_EMPHASES))
+                revision_mode = gr.Radio(["edits", "rewrite"], value="edits", label="Revision of the cover letter", info="edits only regenerates the paragraphs addressed by the critic")
+                history_mode = gr.Radio(["compact", "full"], value="compact", label="Message history passed to the agents")
+                context_mode = gr.Radio(["retrieval", "full"], value="retrieval", label="CV and examples passed to the agents", info="retrieval only passes the sections most relevant to the job description")
+                model_tiers = gr.Radio(["tiered", "strong", "fast"], value="tiered", label="Models of the agents", info=f"tiered uses {MODEL_TIERS['fast'][1]} for planning, critique and the final answer and {MODEL_TIERS['strong'][1]} for writing")
 
 
             extract_button = gr.Button("Extract your information", variant="primary")
@@ -1018,8 +3878,8 @@ with gr.Blocks() as application_agent_server:
             
 
         extract_button.click(
-            fn=extract_information,
-            inputs=[state_dict, cv_file, job_description_file, motivation_file, examples_file, max_iterations],
+            fn=aextract_information if WORKER_MODE != "processes" else remote_extract_information,
+            inputs=[state_dict, cv_file, job_description_file, motivation_file, examples_file, max_iterations, history_mode, drafting_mode, num_drafts, revision_mode, context_mode, model_tiers],
             outputs=[extract_console_output, state_dict, extraction_successful]
         )
 
@@ -1031,9 +3891,11 @@ with gr.Blocks() as application_agent_server:
             """
             gr.Markdown(examples)
             user_query = gr.Textbox(label="Ask your question here", value="Generate a cover letter", interactive=True)
+            stream_drafts = gr.Checkbox(label="Show the drafts of the writer agent while they are generated", value=False)
             button = gr.Button("Ask the application assistant 🦛🤗", variant="primary")
             qa_orchestrator_completed = gr.State(value=False)
 
+            streamed_answer = gr.Markdown("### Call the application assistant to get some results.")
 
             @gr.render(inputs=[qa_orchestrator_completed,state_dict])
             def show_qa_results(qa_flag, state_dict):
@@ -1041,8 +3903,6 @@ with gr.Blocks() as application_agent_server:
                     gr.Markdown(state_dict.get("final_answer", "❗️ No final answer provided: please check the logs."))
                     # reset the flag after orchestor was called
                     # qa_orchestrator_completed.value = False 
-                else:
-                    gr.Markdown("### Call the application assistant to get some results.")
             output_logs = gr.Textbox(label="Logs/ Console Output", lines=10)
 
             # def chat_fn(message : str, history : List, state_dict : Dict):
@@ -1065,16 +3925,16 @@ with gr.Blocks() as application_agent_server:
             #     title="Ask the application assistant"
             # )
             def reset_elements(qa_flag : bool, output_logs : str) -> bool:
-                return False, "Generating response"
+                return False, "Generating response", "⏳ Generating response..."
 
             button.click(
                 fn=reset_elements,
                 inputs=[qa_orchestrator_completed, output_logs],
-                outputs=[qa_orchestrator_completed, output_logs]
+                outputs=[qa_orchestrator_completed, output_logs, streamed_answer]
             ).then(
-                fn=call_orchestrator,
-                inputs=[state_dict, user_query],
-                outputs=[output_logs, state_dict, qa_orchestrator_completed]
+                fn=astream_orchestrator if WORKER_MODE != "processes" else remote_stream_orchestrator,
+                inputs=[state_dict, user_query, stream_drafts],
+                outputs=[output_logs, state_dict, qa_orchestrator_completed, streamed_answer]
             )
 
         with gr.TabItem("🔎 What's under the hood?"):
@@ -1087,7 +3947,30 @@ with gr.Blocks() as application_agent_server:
                     gr.Markdown("There is a LangGraph-powered multi-agent system under the hood using an orchestrator approach to plan and route the requests.")
                     gr.Markdown("Each agent is specialized performing application-related tasks.")
 
+            with gr.Accordion("Latency, token and cost metrics", open=False):
+                metrics_button = gr.Button("Refresh metrics")
+                metrics_summary = gr.JSON(label="Metrics summary")
+                metrics_button.click(fn=metrics.summary, inputs=[], outputs=[metrics_summary], api_name="metrics_summary")
+
+    # headless job API, submission and polling bypass the queue of the browser sessions
+    gr.api(submit_job, api_name="submit_job", queue=False)
+    gr.api(job_status, api_name="job_status", queue=False)
+    gr.api(job_result, api_name="job_result", queue=False)
+    gr.api(stream_job_status, api_name="stream_job_status", concurrency_limit=None, concurrency_id="job_api")
+
 if __name__ == "__main__":
+    # async handlers only wait on the providers, so many sessions can be in flight at the same time
+    concurrency_limit = os.environ.get("GRADIO_CONCURRENCY_LIMIT", "200")
+    application_agent_server.queue(default_concurrency_limit=None if concurrency_limit.lower() == "none" else int(concurrency_limit))
+    if METRICS_PORT.lower() != "off":
+        start_metrics_server(int(METRICS_PORT))
+    if WORKER_MODE == "processes" and WORKER_PROCESSES > 0:
+        start_worker_processes(WORKER_PROCESSES)
+    # in the multi-process deployment, the workers load the models
+    if WARMUP and WORKER_MODE != "processes":
+        start_warm_up()
+    else:
+        _ready.set()
     application_agent_server.launch(mcp_server=True)
 
 
@@ -0,0 +1,163 @@
+"""
+Headless batch mode of the Application Assistant: one CV against many job descriptions.
+
+Job descriptions are read from a directory (.txt, .md, .pdf, .docx) or a JSONL file with one job per line,
+e. g. {"id": "acme-data-scientist", "job_description": "..."} or {"id": "...", "file": "jobs/acme.pdf"}.
+Results are appended to the output JSONL as soon as a job finishes. When the batch is restarted, completed jobs are skipped
+and with CHECKPOINTS=on failed jobs resume from the checkpoint of their last completed step:
+    CHECKPOINTS=on python batch.py --cv CV.md --jobs jobs/ --output results.jsonl --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List, Set
+
+from app import DRAFT_EMPHASES, ApplicationAgentState, arun_graph, index_session_documents, read_file_content, runtime_stats_report
+
+JOB_FILE_SUFFIXES = (".txt", ".md", ".pdf", ".docx")
+
+def load_jobs(jobs : Path) -> List[Dict]:
+    "Return the jobs of a directory or JSONL file as dicts with an id and either the job description or a file"
+    if jobs.is_dir():
+        return [
+            {"id": path.relative_to(jobs).as_posix(), "file": str(path)}
+            for path in sorted(jobs.rglob("*")) if path.suffix.lower() in JOB_FILE_SUFFIXES
+        ]
+
+    items = []
+    with jobs.open(encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            item.setdefault("id", str(line_number))
+            if "file" in item:
+                # files are relative to the JSONL file
+                item["file"] = str(jobs.parent / item["file"])
+            items.append(item)
+    return items
+
+def completed_jobs(output : Path) -> Set[str]:
+    "Ids of the jobs that already finished successfully in a previous run"
+    if not output.exists():
+        return set()
+    completed = set()
+    with output.open(encoding="utf-8") as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # last line of a crashed run
+                continue
+            if result.get("status") == "ok":
+                completed.add(result["id"])
+    return completed
+
+async def run_job(item : Dict, profile : Dict, query : str, keep_logs : bool = False) -> Dict:
+    "Run the agent graph for one job description and return the result record"
+    job_description = item.get("job_description")
+    if job_description is None:
+        job_description = await asyncio.to_thread(read_file_content, item["file"])
+
+    # a failed job resumes from its checkpoint when the batch is restarted
+    state = ApplicationAgentState(session_id=f"batch:{item['id']}", user_query=item.get("query", query), job_description=job_description, **profile)
+    # the relevant sections of the CV depend on the job description
+    index_session_documents(state)
+    # every job gets its own log buffer, like a Gradio session
+    result, buffer = await arun_graph(state)
+    return {
+        "final_answer": result.get("final_answer", ""),
+        "cover_letter": result.get("cover_letter", ""),
+        "feedback": result.get("feedback", ""),
+        "logs": buffer.getvalue() if keep_logs else None,
+    }
+
+async def run_batch(items : List[Dict], profile : Dict, query : str, output : Path, concurrency : int, keep_logs : bool = False) -> List[Dict]:
+    "Run the jobs with at most `concurrency` graphs in flight and append each result to the output file"
+    semaphore = asyncio.Semaphore(concurrency)
+    write_lock = asyncio.Lock()
+    results = []
+
+    async def process(item : Dict):
+        async with semaphore:
+            start = time.perf_counter()
+            record = {"id": item["id"], "query": item.get("query", query)}
+            try:
+                record.update(status="ok", **await run_job(item, profile, query, keep_logs))
+            except Exception as e:
+                record.update(status="error", error=f"{type(e).__name__}: {e}")
+            record["latency"] = round(time.perf_counter() - start, 3)
+
+        async with write_lock:
+            with output.open("a", encoding="utf-8") as file:
+                file.write(json.dumps({key: value for key, value in record.items() if value is not None}, ensure_ascii=False) + "\n")
+            results.append(record)
+            print(f"[{len(results)}/{len(items)}] {record['id']}: {record['status']} in {record['latency']:.2f}s", flush=True)
+
+    await asyncio.gather(*(process(item) for item in items))
+    return results
+
+def batch_report(results : List[Dict], duration : float, skipped : int) -> str:
+    "Throughput and latency summary of a batch run"
+    succeeded = [result["latency"] for result in results if result["status"] == "ok"]
+    report = f"\n📦 Batch: {len(succeeded)} succeeded, {len(results) - len(succeeded)} failed, {skipped} skipped (already completed)\n"
+    report += f"⏱️ Wall time {duration:.1f}s, throughput {len(results) / duration * 60 if duration else 0:.1f} jobs/minute\n"
+    if succeeded:
+        quantiles = statistics.quantiles(succeeded, n=20) if len(succeeded) > 1 else succeeded * 19
+        report += f"⏱️ Latency per job: mean {statistics.mean(succeeded):.2f}s, p50 {statistics.median(succeeded):.2f}s, p95 {quantiles[18]:.2f}s, max {max(succeeded):.2f}s\n"
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Application Assistant for one CV against many job descriptions.")
+    parser.add_argument("--cv", required=True, help="CV file (.md, .txt, .pdf or .docx).")
+    parser.add_argument("--jobs", required=True, help="Directory with job descriptions or JSONL file with one job per line.")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file the results are appended to.")
+    parser.add_argument("--query", default="Generate a cover letter", help="User query for every job, a JSONL job can override it with a 'query' key.")
+    parser.add_argument("--motivation", help="Optional file with your motivation.")
+    parser.add_argument("--examples", help="Optional file with examples of previous cover letters.")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get("BATCH_CONCURRENCY", 4)), help="Maximum number of jobs processed at the same time.")
+    parser.add_argument("--max-iterations", type=int, default=3, help="Maximum number of writer/critic iterations.")
+    parser.add_argument("--history-mode", choices=["compact", "full"], default="compact", help="Message history passed to the agents.")
+    parser.add_argument("--drafting-mode", choices=["iterative", "best_of_n"], default="iterative", help="Revise one draft with the critic or rank several drafts written in parallel.")
+    parser.add_argument("--drafts", type=int, default=3, help=f"Number of parallel drafts in the best_of_n drafting mode (2 to {len(DRAFT_EMPHASES)}).")
+    parser.add_argument("--revision-mode", choices=["edits", "rewrite"], default="edits", help="Revise drafts with paragraph edits or full rewrites.")
+    parser.add_argument("--context-mode", choices=["retrieval", "full"], default="retrieval", help="Pass the relevant sections or the complete CV and examples to the agents.")
+    parser.add_argument("--model-tiers", choices=["tiered", "strong", "fast"], default="tiered", help="Use the model of each agent's tier or the strong or fast model for all agents.")
+    parser.add_argument("--keep-logs", action="store_true", help="Store the agent logs of each job in the results.")
+    args = parser.parse_args()
+    # every draft needs its own emphasis, identical prompts return identical drafts from the response cache
+    if not 2 <= args.drafts <= len(DRAFT_EMPHASES):
+        parser.error(f"--drafts has to be between 2 and {len(DRAFT_EMPHASES)}")
+    # a semaphore of 0 would block every job forever
+    if args.concurrency < 1:
+        parser.error("--concurrency has to be at least 1")
+
+    profile = {
+        "cv": read_file_content(args.cv),
+        "motivation": read_file_content(args.motivation) if args.motivation else "",
+        "examples": read_file_content(args.examples) if args.examples else "",
+        "max_iterations": args.max_iterations,
+        "history_mode": args.history_mode,
+        "drafting_mode": args.drafting_mode,
+        "num_drafts": args.drafts,
+        "revision_mode": args.revision_mode,
+        "context_mode": args.context_mode,
+        "model_tiers": args.model_tiers,
+    }
+    output = Path(args.output)
+    items = load_jobs(Path(args.jobs))
+    completed = completed_jobs(output)
+    pending = [item for item in items if item["id"] not in completed]
+    print(f"📦 {len(items)} jobs, {len(items) - len(pending)} already completed, running {len(pending)} with concurrency {args.concurrency}")
+
+    start = time.perf_counter()
+    results = asyncio.run(run_batch(pending, profile, args.query, output, args.concurrency, args.keep_logs))
+    print(batch_report(results, time.perf_counter() - start, len(items) - len(pending)))
+    print(runtime_stats_report())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Offline benchmark of the Application Assistant based on recorded LLM calls.
+
+Record a cassette once with a live API key:
+    python benchmarks/replay_benchmark.py --record
+
+Replay it without network access and compare against a previous run:
+    python benchmarks/replay_benchmark.py --output results.json --baseline baseline.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+parser = argparse.ArgumentParser(description="Benchmark graph overhead, state serialization and UI handlers with recorded LLM calls.")
+parser.add_argument("--cassette", default=str(REPO_ROOT / "benchmarks" / "cassette.jsonl"), help="Cassette file with the recorded LLM calls.")
+parser.add_argument("--record", action="store_true", help="Call the provider and record the cassette instead of replaying it.")
+parser.add_argument("--query", action="append", help="User query to benchmark (repeatable), defaults to the example queries.")
+parser.add_argument("--runs", type=int, default=5, help="Number of replayed runs per query.")
+parser.add_argument("--latency", default="0", help="Simulated latency per replayed LLM call in seconds or 'recorded'.")
+parser.add_argument("--output", help="Write the results as JSON to this file.")
+parser.add_argument("--baseline", help="Results of a previous run to compare against.")
+parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown compared to the baseline.")
+args = parser.parse_args()
+
+os.environ["LLM_MODE"] = "record" if args.record else "replay"
+os.environ["LLM_CASSETTE"] = args.cassette
+os.environ["LLM_REPLAY_LATENCY"] = args.latency
+# identical requests have to reach the cassette
+os.environ["LLM_CACHE"] = "off"
+
+os.chdir(REPO_ROOT)
+sys.path.insert(0, str(REPO_ROOT))
+import app
+
+queries = args.query or [
+    "Generate a cover letter",
+    "I have an interview with the team lead of the hiring team. Please provide some tailored interview questions.",
+    "Please provide some feedback from the perspective of a recruiter on my CV and previous experience."
+]
+runs = 1 if args.record else args.runs
+
+def timed(function, *function_args, repeat : int = 1) -> list:
+    "Return the durations of repeated calls in seconds"
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*function_args)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def describe(durations : list) -> dict:
+    return {"mean": statistics.mean(durations), "min": min(durations), "max": max(durations), "runs": len(durations)}
+
+results = {}
+
+# UI handler: extraction of the bundled example files
+initial_state = {}
+extract_args = (initial_state, "CV.md", "job-description.txt", "motivation.txt", "examples.txt", 2)
+_, state_dict, _ = app.extract_information(*extract_args)
+results["extract_information"] = describe(timed(app.extract_information, *extract_args, repeat=20))
+
+# state serialization as done by the Gradio handlers
+round_trip = lambda: app.type_conversion(app.ApplicationAgentState.model_validate(state_dict), app.ApplicationAgentState)
+results["state_round_trip"] = describe(timed(round_trip, repeat=200))
+
+# full graph runs, with zero simulated latency this is the overhead of the graph itself
+for query in queries:
+    results[f"call_orchestrator: {query}"] = describe(timed(app.call_orchestrator, state_dict, query, repeat=runs))
+    results[f"stream_orchestrator: {query}"] = describe(timed(lambda: list(app.stream_orchestrator(state_dict, query)), repeat=runs))
+
+for name, result in results.items():
+    print(f"{name[:90]:<90} {result['mean'] * 1000:10.2f} ms")
+
+if args.output:
+    Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+if args.baseline and not args.record:
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    regressions = [
+        f"{name}: {result['mean'] * 1000:.2f} ms (baseline {baseline[name]['mean'] * 1000:.2f} ms)"
+        for name, result in results.items()
+        if name in baseline and result["mean"] > baseline[name]["mean"] * (1 + args.tolerance)
+    ]
+    if regressions:
+        print("\nRegressions:\n" + "\n".join(regressions))
+        sys.exit(1)
+    print("\nNo regressions compared to the baseline.")
@@ -0,0 +1,74 @@
+"""
+Benchmark of the per-session state: memory of idle sessions and serialization cost per graph transition.
+
+Compares the compact session state with the previous layout, which carried the agent registry in every session:
+    python benchmarks/session_state_benchmark.py --sessions 1000
+"""
+import argparse
+import copy
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+parser = argparse.ArgumentParser(description="Benchmark per-session memory and state serialization.")
+parser.add_argument("--sessions", type=int, default=1000, help="Number of simulated idle sessions.")
+parser.add_argument("--transitions", type=int, default=2000, help="Number of simulated graph transitions.")
+args = parser.parse_args()
+
+# no LLM calls are made, replay mode avoids the need for an API key
+os.environ.setdefault("LLM_MODE", "replay")
+os.chdir(REPO_ROOT)
+sys.path.insert(0, str(REPO_ROOT))
+import app
+
+class LegacyApplicationAgentState(app.ApplicationAgentState):
+    "Previous state layout with a copy of the agent registry in every session"
+    available_agents : Dict[str, app.AgentDescription]
+
+def session_memory(state_dict : dict, sessions : int) -> int:
+    "Bytes allocated for idle sessions, Gradio keeps a deep copy of the state per session"
+    tracemalloc.start()
+    copies = [copy.deepcopy(state_dict) for _ in range(sessions)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del copies
+    return size
+
+def transition_time(round_trip, state_dict : dict, transitions : int) -> float:
+    "Mean time in seconds to validate and serialize the state, as done per node transition and button click"
+    start = time.perf_counter()
+    for _ in range(transitions):
+        round_trip(state_dict)
+    return (time.perf_counter() - start) / transitions
+
+_, state_dict, _ = app.extract_information({}, "CV.md", "job-description.txt", "motivation.txt", "examples.txt", 2)
+layouts = {
+    "legacy": (
+        lambda values: LegacyApplicationAgentState.model_validate(values).model_dump(),
+        LegacyApplicationAgentState(**state_dict, available_agents=app.AGENT_REGISTRY).model_dump()
+    ),
+    "compact": (
+        lambda values: app.type_conversion(app.ApplicationAgentState.model_validate(values), app.ApplicationAgentState),
+        state_dict
+    ),
+}
+
+# an empty session only holds the defaults
+empty_layouts = {
+    "legacy": LegacyApplicationAgentState(available_agents=app.AGENT_REGISTRY).model_dump(),
+    "compact": {},
+}
+
+print(f"{'layout':<10} {'empty session':>15} {'filled session':>15} {f'{args.sessions} sessions':>18} {'per transition':>16}")
+for name, (round_trip, filled) in layouts.items():
+    empty_size = len(pickle.dumps(empty_layouts[name]))
+    filled_size = len(pickle.dumps(filled))
+    memory = session_memory(empty_layouts[name], args.sessions)
+    duration = transition_time(round_trip, filled, args.transitions)
+    print(f"{name:<10} {empty_size:>13} B {filled_size:>13} B {memory / 1e6:>15.2f} MB {duration * 1e6:>13.1f} µs")
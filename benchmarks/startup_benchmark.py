@@ -0,0 +1,73 @@
+"""
+Startup benchmark of the Application Assistant: import time, warm-up and latency of the first requests in fresh processes.
+
+    python benchmarks/startup_benchmark.py --runs 5
+    python benchmarks/startup_benchmark.py --cassette benchmarks/cassette.jsonl  # includes the first replayed orchestrator run
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# executed in a fresh interpreter for every run, prints the timings as JSON
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+timings = {"import": time.perf_counter() - start}
+timings["heavy_modules_loaded"] = sorted(name for name in ("docling", "docx", "langchain_openai", "langchain_google_genai") if name in sys.modules)
+
+start = time.perf_counter()
+_, state_dict, _ = app.extract_information({}, "CV.md", "job-description.txt", "motivation.txt", "examples.txt", 2)
+timings["first_extraction"] = time.perf_counter() - start
+
+if WARMUP:
+    start = time.perf_counter()
+    app.warm_up()
+    timings["warm_up"] = time.perf_counter() - start
+
+if QUERY:
+    start = time.perf_counter()
+    app.call_orchestrator(state_dict, QUERY)
+    timings["first_orchestrator_run"] = time.perf_counter() - start
+
+print("TIMINGS " + json.dumps(timings))
+"""
+
+parser = argparse.ArgumentParser(description="Benchmark import time and first-request latency in fresh processes.")
+parser.add_argument("--runs", type=int, default=3, help="Number of fresh processes.")
+parser.add_argument("--cassette", help="Cassette with recorded LLM calls, enables the first orchestrator run in replay mode.")
+parser.add_argument("--query", default="Generate a cover letter", help="User query of the first orchestrator run.")
+parser.add_argument("--warm-up", action="store_true", help="Also measure the warm-up of docling and the LLM client.")
+parser.add_argument("--output", help="Write the results as JSON to this file.")
+args = parser.parse_args()
+
+env = {**os.environ, "LLM_MODE": "replay", "LLM_CACHE": "off", "LLM_REPLAY_LATENCY": "0"}
+if args.cassette:
+    env["LLM_CASSETTE"] = str(Path(args.cassette).resolve())
+probe = f"WARMUP = {args.warm_up!r}\nQUERY = {args.query if args.cassette else None!r}\n" + PROBE
+
+runs = []
+for _ in range(args.runs):
+    completed = subprocess.run([sys.executable, "-c", probe], cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    line = next((line for line in completed.stdout.splitlines() if line.startswith("TIMINGS ")), None)
+    if line is None:
+        sys.exit(f"Probe failed:\n{completed.stderr}")
+    runs.append(json.loads(line[len("TIMINGS "):]))
+
+print(f"Modules loaded at import: {', '.join(runs[0]['heavy_modules_loaded']) or 'none of the lazy ones'}")
+results = {}
+for name in runs[0]:
+    if name == "heavy_modules_loaded":
+        continue
+    durations = [run[name] for run in runs]
+    results[name] = {"mean": statistics.mean(durations), "min": min(durations), "max": max(durations), "runs": len(durations)}
+    print(f"{name:<25} {results[name]['mean'] * 1000:10.1f} ms (min {results[name]['min'] * 1000:.1f} ms)")
+
+if args.output:
+    Path(args.output).write_text(json.dumps(results, indent=2), encoding="utf-8")
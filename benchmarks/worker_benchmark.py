@@ -0,0 +1,88 @@
+"""
+Load test of the multi-process deployment: throughput of the worker processes for different numbers of workers.
+
+The tasks replay recorded LLM calls (see replay_benchmark.py), so the workers only spend CPU on the graph, the prompts and the extraction:
+    python benchmarks/worker_benchmark.py --workers 1 2 4 --tasks 100
+    python benchmarks/worker_benchmark.py --workers 1 4 --latency 0.5   # simulated provider latency per LLM call
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+parser = argparse.ArgumentParser(description="Measure the throughput of the worker processes.")
+parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Numbers of worker processes to compare.")
+parser.add_argument("--tasks", type=int, default=50, help="Number of tasks per run.")
+parser.add_argument("--kind", choices=["call_orchestrator", "extract_information"], default="call_orchestrator", help="Kind of the submitted tasks.")
+parser.add_argument("--concurrency", type=int, default=8, help="Tasks in flight per worker process.")
+parser.add_argument("--cassette", default=str(REPO_ROOT / "benchmarks" / "cassette.jsonl"), help="Cassette file with the recorded LLM calls.")
+parser.add_argument("--latency", default="0", help="Simulated latency per replayed LLM call in seconds or 'recorded'.")
+args = parser.parse_args()
+
+os.environ.update({
+    "WORKER_MODE": "processes",
+    "WORKER_CONCURRENCY": str(args.concurrency),
+    "LLM_MODE": "replay",
+    "LLM_CASSETTE": args.cassette,
+    "LLM_REPLAY_LATENCY": args.latency,
+    # identical requests have to reach the cassette
+    "LLM_CACHE": "off",
+    "WARMUP": "off",
+})
+os.chdir(REPO_ROOT)
+sys.path.insert(0, str(REPO_ROOT))
+import app
+
+_, state_dict, _ = app.extract_information({}, "CV.md", "job-description.txt", "motivation.txt", "examples.txt", 2)
+extract_args = ["CV.md", "job-description.txt", "motivation.txt", "examples.txt", 2]
+
+def payload() -> dict:
+    "Payload of a task, every task is a session of its own"
+    if args.kind == "extract_information":
+        return {"args": [{"session_id": uuid.uuid4().hex}, *extract_args]}
+    return {"state_dict": {**state_dict, "session_id": uuid.uuid4().hex}, "user_query": "Generate a cover letter"}
+
+def run(workers : int, directory : Path) -> dict:
+    "Start the workers on a fresh store, submit the tasks and wait until all of them finished"
+    store_path = directory / f"tasks-{workers}.sqlite"
+    store = app.TaskStore(store_path, app.TASK_LEASE_SECONDS, app.TASK_MAX_ATTEMPTS)
+    environment = {**os.environ, "TASK_STORE_PATH": str(store_path), "METRICS_PORT": "off"}
+    supervisor = subprocess.Popen([sys.executable, "worker.py", "--workers", str(workers)], env=environment, stdout=subprocess.DEVNULL)
+    try:
+        while store.live_workers() < workers:
+            time.sleep(0.2)
+
+        start = time.perf_counter()
+        task_ids = [store.submit(args.kind, payload(), f"client-{i}") for i in range(args.tasks)]
+        pending = set(task_ids)
+        while pending:
+            time.sleep(0.05)
+            pending = {task_id for task_id in pending if store.get(task_id)["status"] in ("queued", "running")}
+        duration = time.perf_counter() - start
+    finally:
+        supervisor.terminate()
+        supervisor.wait()
+
+    tasks = [store.get(task_id) for task_id in task_ids]
+    latencies = [task["finished"] - task["submitted"] for task in tasks]
+    return {
+        "throughput": len(tasks) / duration,
+        "p50": statistics.median(latencies),
+        "p95": statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0],
+        "failed": sum(task["status"] != "done" for task in tasks),
+    }
+
+print(f"{'workers':>8} {'tasks/s':>10} {'speed-up':>9} {'p50 latency':>12} {'p95 latency':>12} {'failed':>7}")
+with tempfile.TemporaryDirectory() as directory:
+    baseline = None
+    for workers in args.workers:
+        result = run(workers, Path(directory))
+        baseline = baseline or result["throughput"]
+        print(f"{workers:>8} {result['throughput']:>10.2f} {result['throughput'] / baseline:>8.2f}x {result['p50']:>11.2f}s {result['p95']:>11.2f}s {result['failed']:>7}")
@@ -0,0 +1,32 @@
+"""
+Worker process of the document extraction pool.
+
+Kept separate from app.py, so that the tasks of the pool don't reference functions of the Gradio app.
+The fork server preloads `__main__` (the app) and this module, so the workers start with both imported;
+the docling models are loaded once per worker by `init_worker`.
+"""
+import time
+from pathlib import Path
+from typing import Tuple
+
+_converter = None
+
+def init_worker():
+    "Load the docling converter and the PDF pipeline models when the worker process starts"
+    global _converter
+    from docling.document_converter import DocumentConverter
+    from docling.datamodel.base_models import InputFormat
+    _converter = DocumentConverter()
+    _converter.initialize_pipeline(InputFormat.PDF)
+
+def ping() -> bool:
+    "No-op task to start a worker ahead of the first document"
+    return _converter is not None
+
+def convert_document(source : str, max_pages : int, max_bytes : int) -> Tuple[str, float, float]:
+    "Convert a document to Markdown, returns the Markdown, the start time and the conversion time in seconds"
+    started = time.time()
+    if _converter is None:
+        init_worker()
+    result = _converter.convert(Path(source), max_num_pages=max_pages, max_file_size=max_bytes)
+    return result.document.export_to_markdown(), started, time.time() - started
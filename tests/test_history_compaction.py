@@ -0,0 +1,38 @@
+"""
+The compacted message history has to fit the token budget of the agents:
+    python -m pytest tests
+"""
+import os
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# no LLM calls are made, replay mode avoids the need for an API key
+os.environ.setdefault("LLM_MODE", "replay")
+os.chdir(REPO_ROOT)
+sys.path.insert(0, str(REPO_ROOT))
+import app
+
+ROLES = ["user query", "recruiter_agent", "team_lead_agent", "writer_agent", "critic_agent", "interview_agent"]
+
+@pytest.mark.parametrize("token_budget", [50, 200, 1000, app.HISTORY_TOKEN_BUDGET])
+def test_history_fits_the_budget(token_budget):
+    generator = random.Random(token_budget)
+    for _ in range(200):
+        messages = [(generator.choice(ROLES), "word " * generator.randint(0, 5000)) for _ in range(generator.randint(1, 12))]
+        assert app.history_tokens(app.compact_messages(messages, token_budget)) <= token_budget
+
+def test_history_within_the_budget_is_kept():
+    messages = [("user query", "Generate a cover letter"), ("recruiter_agent", "Strong fit."), ("writer_agent", "Dear team, ..."), ("critic_agent", "Shorten it.")]
+    assert app.compact_messages(messages, 1000) == messages
+
+def test_latest_draft_and_feedback_are_kept_while_older_contributions_are_dropped():
+    draft, feedback = ("writer_agent", "draft " * 200), ("critic_agent", "feedback " * 20)
+    messages = [("recruiter_agent", "assessment " * 2000), ("team_lead_agent", "assessment " * 2000), draft, feedback]
+    compacted = app.compact_messages(messages, 400)
+    assert compacted[-2:] == [draft, feedback]
+    assert app.history_tokens(compacted) <= 400
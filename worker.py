@@ -0,0 +1,62 @@
+"""
+Worker processes of the multi-process deployment of the Application Assistant.
+
+The workers execute the tasks that the Gradio front-end (`WORKER_MODE=processes`) enqueues in the shared SQLite store.
+A crashed worker is restarted, its running tasks are claimed again once their lease expired:
+    WORKER_MODE=processes WORKER_PROCESSES=0 python app.py   # front-end only
+    python worker.py --workers 4                               # workers, e. g. in another container on the same volume
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from typing import Dict, Optional
+
+def run_worker(prefix : str, metrics_port : Optional[int]):
+    "Entry point of a worker process"
+    # a restarted worker must not renew the leases of the tasks of its crashed predecessor
+    name = f"{prefix}-{os.getpid()}"
+    os.environ["WORKER_MODE"] = "processes"
+    import app
+    if metrics_port:
+        app.start_metrics_server(metrics_port)
+    if app.WARMUP:
+        app.start_warm_up()
+    print(f"Worker {name} started (pid {os.getpid()})")
+    asyncio.run(app.arun_task_worker(name, app.WORKER_CONCURRENCY))
+
+def start_worker(index : int, metrics_port : Optional[int]) -> multiprocessing.Process:
+    name = f"worker-{index}"
+    # not a daemon, the workers start the processes of the document extraction pool
+    process = multiprocessing.get_context("spawn").Process(target=run_worker, args=(name, metrics_port + index if metrics_port else None), name=name)
+    process.start()
+    return process
+
+def main():
+    parser = argparse.ArgumentParser(description="Execute the tasks of the Application Assistant in worker processes.")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKER_PROCESSES", 2)) or 2, help="Number of worker processes.")
+    parser.add_argument("--metrics-port", type=int, help="Serve the metrics of worker i on this port + i.")
+    args = parser.parse_args()
+
+    workers : Dict[int, multiprocessing.Process] = {index: start_worker(index, args.metrics_port) for index in range(args.workers)}
+
+    def stop(signum, frame):
+        for process in workers.values():
+            process.terminate()
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # restart crashed workers, their tasks are claimed again after the lease expired
+    while True:
+        time.sleep(1)
+        for index, process in list(workers.items()):
+            if not process.is_alive():
+                print(f"Worker {process.name} exited with code {process.exitcode}, restarting it")
+                workers[index] = start_worker(index, args.metrics_port)
+
+if __name__ == "__main__":
+    main()